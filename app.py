@@ -1,5 +1,7 @@
 from jinja2 import Environment, FileSystemLoader
 from orm import create_pool, destroy_pool
+from render import start_render_pool
+from config.config import configs
 import factories
 from filters import datetime_filter
 from coroweb import add_routes, add_static
@@ -35,9 +37,12 @@ def init_jinja2(app, **kw):
     app['__templating__'] = env
 
 async def init(loop):
-    await create_pool(loop=loop, host='localhost', port=3306, user='www-data',
-                      password='www-data', db='awesome')
+    # 在建立服务之前启动markdown渲染进程，使工作进程预热完成后再接受请求；
+    # 须在创建数据库连接池之前启动，否则fork出的工作进程会继承打开的MySQL连接
+    start_render_pool()
+    await create_pool(loop=loop, **configs.db)
     app = web.Application(loop=loop, middlewares=[factories.logger_factory,
+                                                  factories.page_cache_factory,
                                                   factories.auth_factory,
                                                   factories.response_factory])
     init_jinja2(app, filters=dict(datetime=datetime_filter))
@@ -0,0 +1,111 @@
+import time
+from collections import OrderedDict
+
+
+# 容量有限的LRU缓存: 超出容量时淘汰最久未被访问的条目
+# sizeof为None时maxsize限制条目数，否则限制所有值经sizeof计算后的总大小(如按字符数限制内存)
+class LRUCache(object):
+    def __init__(self, maxsize=1024, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def items(self):
+        return list(self._data.items())
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        weight = self._weight(value)
+        # 单个值超过总容量时不缓存
+        if weight > self.maxsize:
+            self.pop(key)
+            return
+        if key in self._data:
+            self.size -= self._weight(self._data.pop(key))
+        self._data[key] = value
+        self.size += weight
+        while self.size > self.maxsize:
+            _, old = self._data.popitem(last=False)
+            self.size -= self._weight(old)
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        value = self._data.pop(key)
+        self.size -= self._weight(value)
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+    def _weight(self, value):
+        return 1 if self.sizeof is None else self.sizeof(value)
+
+
+class _Page(object):
+    def __init__(self, body, content_type, expires):
+        self.body = body
+        self.content_type = content_type
+        self.expires = expires
+        self.refreshing = False
+
+
+# 匿名访问的整页缓存，按路径和查询字符串保存渲染好的响应体
+# 页面过期后的stale秒内仍返回旧页面，同时只让一个请求重新生成(stale-while-revalidate)
+class PageCache(object):
+    def __init__(self, maxsize=1000, stale=30):
+        self.stale = stale
+        self._pages = LRUCache(maxsize)
+
+    # 返回可以直接使用的页面；返回None时由调用者生成页面，之后调用set()或release()
+    def get(self, key):
+        page = self._pages.get(key)
+        if page is None:
+            return None
+        now = time.time()
+        if now < page.expires:
+            return page
+        if now < page.expires + self.stale:
+            if page.refreshing:
+                return page
+            page.refreshing = True
+            return None
+        self._pages.pop(key)
+        return None
+
+    def set(self, key, body, content_type, ttl):
+        self._pages.set(key, _Page(body, content_type, time.time() + ttl))
+
+    # 页面生成失败或不可缓存时调用，让之后的请求可以重新生成
+    def release(self, key):
+        page = self._pages.get(key)
+        if page is not None:
+            page.refreshing = False
+
+    # 使路径为path的所有页面(不论查询字符串)失效
+    def invalidate(self, path):
+        for key, page in self._pages.items():
+            if key == path or key.startswith(path + '?'):
+                self._pages.pop(key)
+
+    def clear(self):
+        self._pages.clear()
@@ -5,7 +5,21 @@ configs = {
         'port': 3306,
         'user': 'www-data',
         'password': 'www-data',
-        'db': 'awesome'
+        'db': 'awesome',
+        # 只读副本，每项中的参数覆盖主库的同名参数，如{'host': 'replica1'}
+        'replicas': [],
+        # 副本选择策略: 'round-robin'或'least-busy'
+        'replica_policy': 'round-robin',
+        # 连接池大小；adaptive为True时在连接池前面限制同时使用的连接数，从maxsize开始，
+        # 在[minsize, maxsize]之间按使用和排队情况调整(不会关闭已建立的连接)
+        'minsize': 1,
+        'maxsize': 10,
+        'adaptive': False,
+        # 为True时记录每次取连接的等待和占用时间(/api/stats/pool)，adaptive为True时总会记录
+        'monitor': False,
+        # 执行时间超过slow_query秒的语句写入慢查询日志；explain_slow为True时对慢查询执行EXPLAIN
+        'slow_query': 0.1,
+        'explain_slow': False
     },
     'session': {
         'secret': 'Awesome'
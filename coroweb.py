@@ -10,9 +10,10 @@ from urllib import parse
 
 # *********RequestHandler模块的主要任务为在View（网页）向Controller（路由）之间建立桥梁，与response_factory之间相对应。web框架把Controller的指令构造成一个request发送给View，然后动态生成前段页面；用户在前端页面的某些操作，然后通过request传回到后端，在传回到后端之前先将request进行解析，转变成后端可以处理的事务。RequestHandler负责对这些request进行标准化处理。**************
 
-def get(path):
+def get(path, cache=None):
     # Define decorator @get('/path')
     # 函数经过该函数后，即加入__method__、__route__属性
+    # cache为匿名访问时整页缓存的有效期(秒)，None表示不缓存
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kw):
@@ -20,6 +21,7 @@ def get(path):
 
         wrapper.__method__ = 'GET'
         wrapper.__route__ = path
+        wrapper.__cache__ = cache
         return wrapper
 
     return decorator
@@ -98,6 +100,8 @@ class RequestHandler(object):
         self._has_named_kw_args = has_named_kw_args(fn)
         self._named_kw_args = get_named_kw_args(fn)
         self._required_kw_args = get_required_kw_args(fn)
+        self._bind = self._make_binder()
+        self._cache_ttl = getattr(fn, '__cache__', None)
 
     # # 任何一个类，只需要定义一个__call__()方法，就可以直接对实例进行调用
     # async def __call__(self, request):
@@ -135,60 +139,93 @@ class RequestHandler(object):
     #     except errors.APIError as e:
     #         return dict(error=e.error, data=e.data, message=e.message)
     async def __call__(self, request):
-        kw = None
-        if self._has_var_kw_arg or self._has_named_kw_args or self._required_kw_args:
+        kw = await self._bind(request)
+        if not isinstance(kw, dict):
+            return kw
+        if self._cache_ttl:
+            # 告知page_cache_factory该页面可以缓存多久
+            request.__cache_ttl__ = self._cache_ttl
+        logging.info('call with args: %s', kw)
+        try:
+            r = await self._func(**kw)
+            return r
+        except errors.APIError as e:
+            return dict(error=e.error, data=e.data, message=e.message)
+
+    # 注册路由时根据函数签名生成专用的参数绑定函数，每个请求只执行该URL函数需要的步骤
+    # 绑定函数返回传给URL函数的参数dict，参数有误时返回错误响应
+    def _make_binder(self):
+        has_request_arg = self._has_request_arg
+        if not (self._has_var_kw_arg or self._has_named_kw_args or self._required_kw_args):
+            # 只接受路径参数(和request)，无需解析请求体和查询字符串
+            if has_request_arg:
+                async def bind(request):
+                    kw = dict(request.match_info)
+                    kw['request'] = request
+                    return kw
+            else:
+                async def bind(request):
+                    return dict(request.match_info)
+            return bind
+
+        # 没有**kw参数时，只保留命名关键字参数
+        names = None if self._has_var_kw_arg else frozenset(self._named_kw_args)
+        required = self._required_kw_args
+
+        async def bind(request):
             if request.method == 'POST':
-                if not request.content_type:
-                    return web.HTTPBadRequest('Missing Content-Type.')
-                ct = request.content_type.lower()
-                if ct.startswith('application/json'):
-                    params = await request.json()
-                    if not isinstance(params, dict):
-                        return web.HTTPBadRequest('JSON body must be object.')
-                    kw = params
-                elif ct.startswith(
-                        'application/x-www-form-urlencoded') or ct.startswith(
-                    'multipart/form-data'):
-                    params = await request.post()
-                    kw = dict(**params)
-                else:
-                    return web.HTTPBadRequest(
-                        'Unsupported Content-Type: %s' % request.content_type)
-            if request.method == 'GET':
-                qs = request.query_string
-                if qs:
-                    kw = dict()
-                    for k, v in parse.parse_qs(qs, True).items():
-                        kw[k] = v[0]
-        if kw is None:
-            kw = dict(**request.match_info)
-        else:
-            if not self._has_var_kw_arg and self._named_kw_args:
-                # remove all unamed kw:
-                copy = dict()
-                for name in self._named_kw_args:
-                    if name in kw:
-                        copy[name] = kw[name]
-                kw = copy
+                kw = await parse_body(request)
+                if not isinstance(kw, dict):
+                    return kw
+                if names is not None:
+                    kw = {k: v for k, v in kw.items() if k in names}
+            elif request.method == 'GET':
+                kw = parse_query(request.query_string, names)
+            else:
+                kw = dict()
             # check named arg:
             for k, v in request.match_info.items():
                 if k in kw:
                     logging.warning(
                         'Duplicate arg name in named arg and kw args: %s' % k)
                 kw[k] = v
-        if self._has_request_arg:
-            kw['request'] = request
-        # check required kw:
-        if self._required_kw_args:
-            for name in self._required_kw_args:
-                if not name in kw:
+            if has_request_arg:
+                kw['request'] = request
+            # check required kw:
+            for name in required:
+                if name not in kw:
                     return web.HTTPBadRequest('Missing argument: %s' % name)
-        logging.info('call with args: %s' % str(kw))
-        try:
-            r = await self._func(**kw)
-            return r
-        except errors.APIError as e:
-            return dict(error=e.error, data=e.data, message=e.message)
+            return kw
+        return bind
+
+
+# 解析POST请求体，返回参数dict，格式有误时返回错误响应
+async def parse_body(request):
+    if not request.content_type:
+        return web.HTTPBadRequest('Missing Content-Type.')
+    ct = request.content_type.lower()
+    if ct.startswith('application/json'):
+        params = await request.json()
+        if not isinstance(params, dict):
+            return web.HTTPBadRequest('JSON body must be object.')
+        return params
+    elif ct.startswith(
+            'application/x-www-form-urlencoded') or ct.startswith(
+        'multipart/form-data'):
+        params = await request.post()
+        return dict(**params)
+    return web.HTTPBadRequest(
+        'Unsupported Content-Type: %s' % request.content_type)
+
+
+# 解析查询字符串，同名参数取第一个值；names不为None时只保留其中的参数
+def parse_query(qs, names=None):
+    kw = dict()
+    if qs:
+        for k, v in parse.parse_qsl(qs, True):
+            if k not in kw and (names is None or k in names):
+                kw[k] = v
+    return kw
 
 
 def add_route(app, fn):
@@ -1,5 +1,6 @@
 import logging
 import json
+import base64
 
 
 class Page(object):
@@ -67,6 +68,94 @@ class Page(object):
         self.pagelist = list(range(left, right))
 
 
+class CursorPage(object):
+    '''
+    Cursor (keyset) based page object for list APIs.
+    '''
+    def __init__(self, cursor='', page_size=10, keys=('created_at', 'id')):
+        '''
+                Init Pagination by an opaque cursor token from a previous page.
+                An empty cursor means the first page. Pass after/before/limit
+                to Model.findAll(), then trim the result by paginate().
+                >>> p1 = CursorPage('', 2)
+                >>> p1.after, p1.before, p1.limit
+                ((), None, 3)
+                >>> items = p1.paginate([dict(created_at=1.0, id='a'), dict(created_at=2.0, id='b'), dict(created_at=3.0, id='c')])
+                >>> [i['id'] for i in items], p1.has_next, p1.has_previous
+                (['a', 'b'], True, False)
+                >>> p2 = CursorPage(p1.next_cursor, 2)
+                >>> p2.after, p2.before
+                ((2.0, 'b'), None)
+                >>> items = p2.paginate([dict(created_at=3.0, id='c')])
+                >>> [i['id'] for i in items], p2.has_next, p2.has_previous
+                (['c'], False, True)
+                >>> p3 = CursorPage(p2.prev_cursor, 2)
+                >>> p3.after, p3.before
+                (None, (3.0, 'c'))
+        '''
+        self.page_size = page_size
+        self.keys = keys
+        self.after = None
+        self.before = None
+        if cursor:
+            direction, key = self._decode(cursor)
+            if direction == 'n':
+                self.after = key
+            else:
+                self.before = key
+        else:
+            self.after = ()
+        # 多取一条用于判断是否还有下一页(或上一页)
+        self.limit = page_size + 1
+        self.has_next = False
+        self.has_previous = False
+        self.next_cursor = None
+        self.prev_cursor = None
+
+    def __str__(self):
+        return 'page_size: %s, has_next: %s, has_previous: %s, next_cursor: %s, prev_cursor: %s' % (self.page_size, self.has_next, self.has_previous, self.next_cursor, self.prev_cursor)
+
+    __repr__ = __str__
+
+    def paginate(self, items):
+        # items为findAll按after/before/limit查询的结果，去掉多取的一条并生成前后页的游标
+        extra = len(items) > self.page_size
+        if self.before is not None:
+            if extra:
+                items = items[-self.page_size:]
+            self.has_previous = extra
+            self.has_next = True
+        else:
+            if extra:
+                items = items[:self.page_size]
+            self.has_next = extra
+            self.has_previous = self.after != ()
+        if items:
+            if self.has_next:
+                self.next_cursor = self._encode('n', items[-1])
+            if self.has_previous:
+                self.prev_cursor = self._encode('p', items[0])
+        return items
+
+    def _encode(self, direction, item):
+        token = json.dumps([direction] + [item[k] for k in self.keys], separators=(',', ':'))
+        return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def _decode(self, cursor):
+        try:
+            token = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(token.decode('utf-8'))
+        except (ValueError, TypeError):
+            raise APIValueError('cursor', 'invalid cursor.')
+        if not isinstance(values, list) or len(values) != len(self.keys) + 1 or values[0] not in ('n', 'p'):
+            raise APIValueError('cursor', 'invalid cursor.')
+        # 排序键的值只能是字符串或数字，游标是客户端传入的，其他类型的值不能交给findAll
+        for value in values[1:]:
+            if type(value) not in (str, int, float):
+                raise APIValueError('cursor', 'invalid cursor.')
+        return values[0], tuple(values[1:])
+
+
 class APIError(Exception):
 
     # 基本的API错误，包括必须的errors,可选的data和message
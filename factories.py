@@ -1,8 +1,8 @@
 import logging
-import json
+import serializer
 from aiohttp import web
 from urllib import parse
-from handlers import cookie2user, COOKIE_NAME
+from handlers import cookie2user, COOKIE_NAME, page_cache
 from model import User
 
 # 在每个响应之前打印日志
@@ -13,6 +13,30 @@ async def logger_factory(app, handler):
     return logger
 
 
+# 匿名访问的整页缓存: 没有登录cookie的GET请求直接返回缓存的页面，不再查询数据库和渲染模板
+# 页面能否缓存及有效期由URL函数的@get(path, cache=秒数)决定
+async def page_cache_factory(app, handler):
+    async def cached_page(request):
+        if request.method != 'GET' or COOKIE_NAME in request.cookies:
+            return await handler(request)
+        key = request.path_qs
+        page = page_cache.get(key)
+        if page is not None:
+            return web.Response(body=page.body, headers={'Content-Type': page.content_type})
+        try:
+            r = await handler(request)
+        except BaseException:
+            page_cache.release(key)
+            raise
+        ttl = getattr(request, '__cache_ttl__', None)
+        if ttl and isinstance(r, web.Response) and r.status == 200 and not r.cookies and r.body is not None:
+            page_cache.set(key, r.body, r.headers.get('Content-Type'), ttl)
+        else:
+            page_cache.release(key)
+        return r
+    return cached_page
+
+
 # 通过cookie找到当前用户信息，把用户绑定在request.__user__
 async def auth_factory(app, handler):
     async def auth(request):
@@ -84,9 +108,7 @@ async def response_factory(app, handler):
             template = r.get('__template__')
 
             if template is None:
-                resp = web.Response(body=json.dumps(r, ensure_ascii=False,
-                                                    default=lambda o:
-                                                    o.__dict__).encode('utf-8'))
+                resp = web.Response(body=serializer.dumps(r))
                 resp.content_type = 'application/json;charset=utf-8'
                 return resp
             else:
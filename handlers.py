@@ -4,15 +4,29 @@
 from coroweb import get, post
 from model import User, Comment, Blog, next_id
 import re, time, json, logging, hashlib, base64
-from errors import Page, APIValueError, APIPermissionError, APIResourceNotFoundError
+from errors import Page, CursorPage, APIValueError, APIPermissionError, APIResourceNotFoundError
 from aiohttp import web
 from config.config import configs
-import markdown2
+from render import render_markdown
+from cache import LRUCache, PageCache
+import serializer
+import orm
 
 COOKIE_NAME = 'awesession'
 # _COOKIE_KEY为config_default中的secret
 _COOKIE_KEY = configs.session.secret
 
+# 已验证会话的缓存: cookie => (user, 缓存过期时间)，避免每个请求都查询数据库验证cookie
+# 缓存过期时间不超过cookie自身的过期时间
+SESSION_CACHE_TTL = 300
+_session_cache = LRUCache(10000)
+# 用户会话的失效次数: uid => 计数，invalidate_sessions时加一；验证cookie期间计数变化时不缓存验证结果，
+# 否则查询数据库之后、写入缓存之前发生的修改(如改密码)会被按旧数据验证的会话覆盖
+_session_generations = {}
+
+# 匿名访问的整页缓存，由factories.page_cache_factory使用；日志和评论的写操作使相关页面失效
+page_cache = PageCache()
+
 
 def check_admin(request):
     if request.__user__ is None or not request.__user__.admin:
@@ -30,6 +44,13 @@ def get_page_index(page_str):
     return p
 
 
+# 游标分页: 按cursor取出model的一页记录，不需要统计总数，深层页面与第一页的代价相同
+async def get_cursor_page(model, cursor, desc=False):
+    p = CursorPage(cursor, keys=model.__seek__)
+    items = await model.findAll(after=p.after, before=p.before, desc=desc, limit=p.limit)
+    return p, p.paginate(items)
+
+
 def user2cookie(user, max_age):
     # 为用户生成cookie字符串，通过id-expires-sha1
     expires = str(int(time.time() + max_age))
@@ -42,12 +63,29 @@ def text2html(text):
     lines = map(lambda s: '<p>%s</p>' % s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'), filter(lambda s: s.strip() != '', text.split('\n')))
     return ''.join(lines)
 
+# 使某个用户的所有缓存会话失效，用户信息(如密码、管理员权限)修改或被删除时调用
+def invalidate_sessions(uid):
+    _session_generations[uid] = _session_generations.get(uid, 0) + 1
+    for cookie_str, (user, expires) in _session_cache.items():
+        if user.id == uid:
+            _session_cache.pop(cookie_str)
+
+
+User.addListener(lambda user: invalidate_sessions(user.id))
+
+
 async def cookie2user(cookie_str):
     '''
     Parse cookie and load user if cookie is valid.
     '''
     if not cookie_str:
         return None
+    cached = _session_cache.get(cookie_str)
+    if cached is not None:
+        user, expires = cached
+        if expires > time.time():
+            return User(**user)
+        _session_cache.pop(cookie_str)
     try:
         L = cookie_str.split('-')
         if len(L) != 3:
@@ -55,6 +93,7 @@ async def cookie2user(cookie_str):
         uid, expires, sha1 = L
         if int(expires) < time.time():
             return None
+        generation = _session_generations.get(uid, 0)
         user = await User.find(uid)
         if user is None:
             return None
@@ -63,6 +102,8 @@ async def cookie2user(cookie_str):
             logging.info('invalid sha1')
             return None
         user.passwd = '******'
+        if _session_generations.get(uid, 0) == generation:
+            _session_cache.set(cookie_str, (User(**user), min(int(expires), time.time() + SESSION_CACHE_TTL)))
         return user
     except Exception as e:
         logging.exception(e)
@@ -70,7 +111,7 @@ async def cookie2user(cookie_str):
 
 
 # 首页
-@get('/')
+@get('/', cache=30)
 async def index(*, page='1'):
     page_index = get_page_index(page)
     num = await Blog.findNumber('count(id)')
@@ -79,7 +120,8 @@ async def index(*, page='1'):
     if num == 0:
         blogs = []
     else:
-        blogs = await Blog.findAll(orderBy='created_at desc', limit=(page.offset, page.limit))
+        # 首页只在模板中读取日志字段，使用紧凑的Record对象
+        blogs = await Blog.findAll(orderBy='created_at desc', limit=(page.offset, page.limit), compact=True)
     return {
         '__template__': 'blogs.html',
         'page': page,
@@ -88,7 +130,7 @@ async def index(*, page='1'):
 
 
 # 关于博主页面
-@get('/about')
+@get('/about', cache=3600)
 async def about():
     return {
         '__template__': 'about.html'
@@ -114,6 +156,7 @@ def register():
 # 登出 __base__.html:button-登出
 @get('/signout')
 def signout(request):
+    _session_cache.pop(request.cookies.get(COOKIE_NAME))
     referer = request.headers.get('Referer')
     r = web.HTTPFound(referer or '/')
     r.set_cookie(COOKIE_NAME, '-deleted-', max_age=0, httponly=True)
@@ -175,14 +218,14 @@ def manage_blogs(*, page='1'):
 
 
 # 日志详情页 blogs.html日志列表页中的button-blog.name与button-继续阅读
-@get('/blog/{id}')
+@get('/blog/{id}', cache=60)
 async def get_blog(id):
         blog = await Blog.find(id)
         comments = await Comment.findAll('blog_id=?', [id],
                                          orderBy='created_at')
         for c in comments:
                 c.html_content = text2html(c.content)
-        blog.html_content = markdown2.markdown(blog.content)
+        blog.html_content = await render_markdown(blog.content)
         return {
             '__template__': 'blog.html',
             'blog': blog,
@@ -216,13 +259,18 @@ async def authenticate(*, email, passwd):
     r.set_cookie(COOKIE_NAME, user2cookie(user, 86400), max_age=86400, httponly=True)
     user.passwd = '******'
     r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    r.body = serializer.dumps(user)
     return r
 
 
 # 后端API:获取用户列表 manage_users.html
 @get('/api/users')
-async def api_get_users(*, page='1'):
+async def api_get_users(*, page='1', cursor=None):
+    if cursor is not None:
+        p, users = await get_cursor_page(User, cursor)
+        for u in users:
+            u.passwd = '******'
+        return dict(page=p, users=users)
     page_index = get_page_index(page)
     num = await User.findNumber('count(id)')
     p = Page(num, page_index)
@@ -254,13 +302,16 @@ async def api_register_user(*, email, name, passwd):
     r.set_cookie(COOKIE_NAME, user2cookie(user, 86400), max_age=86400, httponly=True)
     user.passwd = '******'
     r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    r.body = serializer.dumps(user)
     return r
 
 
 # 后端API：获取日志列表 manage_blogs.html
 @get('/api/blogs')
-async def api_blogs(*, page='1'):
+async def api_blogs(*, page='1', cursor=None):
+    if cursor is not None:
+        p, blogs = await get_cursor_page(Blog, cursor)
+        return dict(page=p, blogs=blogs)
     page_index = get_page_index(page)
     num = await Blog.findNumber('count(id)')
     p = Page(num, page_index)
@@ -282,6 +333,9 @@ async def api_create_blog(request, *, name, summary, content):
         raise APIValueError('content', 'content cannot be empty.')
     blog = Blog(user_id=request.__user__.id, user_name=request.__user__.name, user_image=request.__user__.image, name=name.strip(), summary=summary.strip(), content=content.strip())
     await blog.save()
+    # 保存时预先渲染正文，之后浏览日志时直接命中缓存
+    await render_markdown(blog.content)
+    page_cache.invalidate('/')
     return blog
 
 
@@ -300,6 +354,9 @@ async def api_update_blog(id, request, *, name, summary, content):
     blog.summary = summary.strip()
     blog.content = content.strip()
     await blog.update()
+    await render_markdown(blog.content)
+    page_cache.invalidate('/')
+    page_cache.invalidate('/blog/%s' % id)
     return blog
 
 
@@ -309,6 +366,8 @@ async def api_delete_blog(request, *, id):
     check_admin(request)
     blog = await Blog.find(id)
     await blog.remove()
+    page_cache.invalidate('/')
+    page_cache.invalidate('/blog/%s' % id)
     return dict(id=id)
 
 
@@ -321,7 +380,10 @@ async def api_get_blog(*, id):
 
 # 后端API:获取评论列表 manage_comments.html
 @get('/api/comments')
-async def api_comments(*, page='1'):
+async def api_comments(*, page='1', cursor=None):
+    if cursor is not None:
+        p, comments = await get_cursor_page(Comment, cursor)
+        return dict(page=p, comments=comments)
     page_index = get_page_index(page)
     num = await Comment.findNumber('count(id)')
     p = Page(num, page_index)
@@ -344,6 +406,7 @@ async def api_create_comment(id, request, *, content):
         raise APIResourceNotFoundError('Blog')
     comment = Comment(blog_id=blog.id, user_id=user.id, user_name=user.name, user_image=user.image, content=content.strip())
     await comment.save()
+    page_cache.invalidate('/blog/%s' % blog.id)
     return comment
 
 
@@ -355,4 +418,19 @@ async def api_delete_comments(id, request):
     if c is None:
         raise APIResourceNotFoundError('Comment')
     await c.remove()
+    page_cache.invalidate('/blog/%s' % c.blog_id)
     return dict(id=id)
+
+
+# 后端API:连接池和SQL执行的统计快照，仅管理员可见
+@get('/api/stats/pool')
+async def api_pool_stats(request):
+    check_admin(request)
+    return orm.pool_stats()
+
+
+# 后端API:按SQL指纹汇总的慢查询，包括调用位置和EXPLAIN结果，仅管理员可见
+@get('/api/stats/slow')
+async def api_slow_queries(request):
+    check_admin(request)
+    return dict(queries=orm.slow_queries())
@@ -94,6 +94,8 @@ except ImportError:
 import optparse
 from random import random, randint
 import codecs
+import threading
+from collections import OrderedDict
 
 
 #---- Python version compat
@@ -132,7 +134,9 @@ log = logging.getLogger("markdown")
 DEFAULT_TAB_WIDTH = 4
 
 
-SECRET_SALT = bytes(randint(0, 1000000))
+# Note: `bytes(n)` is a string of n digits on Python 2 but n zero bytes on
+# Python 3, which made every `_hash_text()` call md5 up to a megabyte.
+SECRET_SALT = str(randint(0, 1000000)).encode("utf-8")
 def _hash_text(s):
     return 'md5-' + md5(SECRET_SALT + s.encode("utf-8")).hexdigest()
 
@@ -166,10 +170,85 @@ def markdown_path(path, encoding="utf-8",
 def markdown(text, html4tags=False, tab_width=DEFAULT_TAB_WIDTH,
              safe_mode=None, extras=None, link_patterns=None,
              use_file_vars=False):
-    return Markdown(html4tags=html4tags, tab_width=tab_width,
-                    safe_mode=safe_mode, extras=extras,
-                    link_patterns=link_patterns,
-                    use_file_vars=use_file_vars).convert(text)
+    options = dict(html4tags=html4tags, tab_width=tab_width,
+                   safe_mode=safe_mode, extras=extras,
+                   link_patterns=link_patterns,
+                   use_file_vars=use_file_vars)
+    markdowner = _acquire_converter(options)
+    try:
+        return markdowner.convert(text)
+    finally:
+        _release_converter(markdowner)
+
+def markdown_blocks(text, html4tags=False, tab_width=DEFAULT_TAB_WIDTH,
+                    safe_mode=None, extras=None, link_patterns=None,
+                    use_file_vars=False):
+    """Like `markdown()`, but memoizes the HTML of each top-level block so
+    that re-converting an edited document only converts the changed blocks.
+
+    Documents that can't be converted block by block (see
+    `_block_convertible()`) get a plain full conversion.
+    """
+    options = dict(html4tags=html4tags, tab_width=tab_width,
+                   safe_mode=safe_mode, extras=extras,
+                   link_patterns=link_patterns,
+                   use_file_vars=use_file_vars)
+    markdowner = _acquire_converter(options)
+    try:
+        return markdowner.convert_blocks(text)
+    finally:
+        _release_converter(markdowner)
+
+
+#---- converter pool
+# `Markdown.convert()` calls `reset()` first, so a converter can be reused
+# for any number of documents. It is not safe to use one converter from
+# two threads at once, though, so idle converters are kept in a pool per
+# option set and each conversion checks one out.
+
+MAX_IDLE_CONVERTERS = 8
+_converters = {}    # option key -> list of idle `Markdown` instances
+_converters_lock = threading.Lock()
+
+def _converter_key(options):
+    """Return a hashable key for the given `Markdown` constructor options,
+    or None if they can't be keyed (e.g. unhashable extra arguments).
+    """
+    extras = options["extras"]
+    if isinstance(extras, dict):
+        extras = tuple(sorted(extras.items()))
+    elif extras:
+        extras = tuple(sorted(extras))
+    link_patterns = options["link_patterns"]
+    if link_patterns:
+        link_patterns = tuple(tuple(p) for p in link_patterns)
+    key = (options["html4tags"], options["tab_width"], options["safe_mode"],
+           extras, link_patterns, options["use_file_vars"])
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+def _acquire_converter(options):
+    key = _converter_key(options)
+    if key is not None:
+        with _converters_lock:
+            idle = _converters.get(key)
+            if idle:
+                return idle.pop()
+    markdowner = Markdown(**options)
+    markdowner._pool_key = key
+    return markdowner
+
+def _release_converter(markdowner):
+    key = markdowner._pool_key
+    if key is None:
+        return
+    with _converters_lock:
+        idle = _converters.setdefault(key, [])
+        if len(idle) < MAX_IDLE_CONVERTERS:
+            idle.append(markdowner)
 
 class Markdown(object):
     # The dict of "extras" to enable in processing -- a mapping of
@@ -182,6 +261,7 @@ class Markdown(object):
 
     urls = None
     titles = None
+    _pool_key = None    # converter options key, set by `_acquire_converter()`
     html_blocks = None
     html_spans = None
     html_removed_text = "[HTML_REMOVED]"  # for compat with markdown.py
@@ -224,7 +304,7 @@ class Markdown(object):
 
         self.link_patterns = link_patterns
         self.use_file_vars = use_file_vars
-        self._outdent_re = re.compile(r'^(\t|[ ]{1,%d})' % tab_width, re.M)
+        self._outdent_re = _outdent_re_from_tab_width(tab_width)
 
         self._escape_table = g_escape_table.copy()
         if "smarty-pants" in self.extras:
@@ -237,6 +317,7 @@ class Markdown(object):
         self.html_blocks = {}
         self.html_spans = {}
         self.list_level = 0
+        self._toc = None
         self.extras = self._instance_extras.copy()
         if "footnotes" in self.extras:
             self.footnotes = {}
@@ -246,6 +327,68 @@ class Markdown(object):
         if "metadata" in self.extras:
             self.metadata = {}
 
+    def convert_blocks(self, text):
+        """Convert the given text block by block, reusing the cached HTML
+        of blocks seen before with the same options and link definitions.
+
+        The result is the same as `convert(text)`, but without the "toc" and
+        "metadata" attributes: documents using extras with document-wide
+        state (footnotes, header ids, metadata) are converted in full.
+        """
+        if self._pool_key is None or not _block_convertible(self, text):
+            return self.convert(text)
+        original = text
+        # Normalise the text the way `convert()` does before it strips
+        # link definitions: a whitespace-only line must not end a
+        # paragraph here when it doesn't in `convert()`.
+        text = _line_ending_re.sub("\n", text)
+        text = self._detab(text)
+        text = self._ws_only_line_re.sub("", text)
+        fenced = "fenced-code-blocks" in self.extras
+
+        # Link definitions can be referenced from any block. Strip them
+        # from the whole document first, as `convert()` does (so a
+        # definition between two list items doesn't split the list), and
+        # append all of them to every converted block.
+        # A definition-like line inside a fenced code block is code, and
+        # `convert()` hashes fenced blocks before stripping definitions.
+        link_def_re = _link_def_re_from_tab_width(self.tab_width)
+        defs = []
+        if "[" in text:
+            segments = []
+            pos = 0
+            for start, end in _fence_spans(text) if fenced else ():
+                segments.append(text[pos:start])
+                segments.append(text[start:end])
+                pos = end
+            segments.append(text[pos:])
+            for i in range(0, len(segments), 2):
+                found = [m.group(0) for m in link_def_re.finditer(segments[i])]
+                if found:
+                    defs.extend(found)
+                    segments[i] = link_def_re.sub("", segments[i])
+            text = "".join(segments)
+        defs = "".join(d if d.endswith("\n") else d + "\n" for d in defs)
+        blocks = _split_blocks(text, fenced)
+        if blocks is None:
+            return self.convert(original)
+        scope = (self._pool_key, md5(defs.encode("utf-8")).digest())
+
+        html = []
+        for block in blocks:
+            if not block.strip():
+                continue
+            key = (scope, md5(block.encode("utf-8")).digest())
+            block_html = _block_cache.get(key)
+            if block_html is None:
+                block_html = self.convert(block + "\n\n" + defs).rstrip("\n")
+                _block_cache.set(key, block_html)
+            if block_html:
+                html.append(block_html)
+        if not html:
+            return self.convert(original)
+        return UnicodeWithAttrs("\n\n".join(html) + "\n")
+
     # Per <https://developer.mozilla.org/en-US/docs/HTML/Element/a> "rel"
     # should only be used in <a> tags with an "href" attribute.
     _a_nofollow = re.compile(r"<(a)([^>]*href=)", re.IGNORECASE)
@@ -271,8 +414,7 @@ class Markdown(object):
             # Look for emacs-style file variable hints.
             emacs_vars = self._get_emacs_vars(text)
             if "markdown-extras" in emacs_vars:
-                splitter = re.compile("[ ,]+")
-                for e in splitter.split(emacs_vars["markdown-extras"]):
+                for e in _extras_splitter_re.split(emacs_vars["markdown-extras"]):
                     if '=' in e:
                         ename, earg = e.split('=', 1)
                         try:
@@ -284,7 +426,7 @@ class Markdown(object):
                     self.extras[ename] = earg
 
         # Standardize line endings:
-        text = re.sub("\r\n|\r", "\n", text)
+        text = _line_ending_re.sub("\n", text)
 
         # Make sure $text ends with a couple of newlines:
         text += "\n\n"
@@ -697,28 +839,9 @@ class Markdown(object):
     def _strip_link_definitions(self, text):
         # Strips link definitions from text, stores the URLs and titles in
         # hash references.
-        less_than_tab = self.tab_width - 1
-
         # Link defs are in the form:
         #   [id]: url "optional title"
-        _link_def_re = re.compile(r"""
-            ^[ ]{0,%d}\[(.+)\]: # id = \1
-              [ \t]*
-              \n?               # maybe *one* newline
-              [ \t]*
-            <?(.+?)>?           # url = \2
-              [ \t]*
-            (?:
-                \n?             # maybe one newline
-                [ \t]*
-                (?<=\s)         # lookbehind for whitespace
-                ['"(]
-                ([^\n]*)        # title = \3
-                ['")]
-                [ \t]*
-            )?  # title is optional
-            (?:\n+|\Z)
-            """ % less_than_tab, re.X | re.M | re.U)
+        _link_def_re = _link_def_re_from_tab_width(self.tab_width)
         return _link_def_re.sub(self._extract_link_def_sub, text)
 
     def _extract_link_def_sub(self, match):
@@ -732,7 +855,7 @@ class Markdown(object):
     def _extract_footnote_def_sub(self, match):
         id, text = match.groups()
         text = _dedent(text, skip_first_line=not text.startswith('\n')).strip()
-        normed_id = re.sub(r'\W', '-', id)
+        normed_id = _non_word_re.sub('-', id)
         # Ensure footnote text ends with a couple newlines (for some
         # block gamut matches).
         self.footnotes[normed_id] = text + "\n\n"
@@ -749,22 +872,7 @@ class Markdown(object):
             [^note-id]:
                 Text of the note.
         """
-        less_than_tab = self.tab_width - 1
-        footnote_def_re = re.compile(r'''
-            ^[ ]{0,%d}\[\^(.+)\]:   # id = \1
-            [ \t]*
-            (                       # footnote text = \2
-              # First line need not start with the spaces.
-              (?:\s*.*\n+)
-              (?:
-                (?:[ ]{%d} | \t)  # Subsequent lines must be indented.
-                .*\n+
-              )*
-            )
-            # Lookahead for non-space at line-start, or end of doc.
-            (?:(?=^[ ]{0,%d}\S)|\Z)
-            ''' % (less_than_tab, self.tab_width, self.tab_width),
-            re.X | re.M)
+        footnote_def_re = _footnote_def_re_from_tab_width(self.tab_width)
         return footnote_def_re.sub(self._extract_footnote_def_sub, text)
 
     _hr_re = re.compile(r'^[ ]{0,3}([-_*][ ]{0,2}){3,}$', re.M)
@@ -825,13 +933,7 @@ class Markdown(object):
         if ">>>" not in text:
             return text
 
-        less_than_tab = self.tab_width - 1
-        _pyshell_block_re = re.compile(r"""
-            ^([ ]{0,%d})>>>[ ].*\n   # first line
-            ^(\1.*\S+.*\n)*         # any number of subsequent lines
-            ^\n                     # ends with a blank line
-            """ % less_than_tab, re.M | re.X)
-
+        _pyshell_block_re = _pyshell_block_re_from_tab_width(self.tab_width)
         return _pyshell_block_re.sub(self._pyshell_block_sub, text)
 
     def _table_sub(self, match):
@@ -879,26 +981,7 @@ class Markdown(object):
         """Copying PHP-Markdown and GFM table syntax. Some regex borrowed from
         https://github.com/michelf/php-markdown/blob/lib/Michelf/Markdown.php#L2538
         """
-        less_than_tab = self.tab_width - 1
-        table_re = re.compile(r'''
-                (?:(?<=\n\n)|\A\n?)             # leading blank line
-                ^[ ]{0,%d}                      # allowed whitespace
-                (.*[|].*)  \n                   # $1: header row (at least one pipe)
-                ^[ ]{0,%d}                      # allowed whitespace
-                (                               # $2: underline row
-                    # underline row with leading bar
-                    (?:  \|\ *:?-+:?\ *  )+  \|?  \n
-                    |
-                    # or, underline row without leading bar
-                    (?:  \ *:?-+:?\ *\|  )+  (?:  \ *:?-+:?\ *  )?  \n
-                )
-                (                               # $3: data rows
-                    (?:
-                        ^[ ]{0,%d}(?!\ )         # ensure line begins with 0 to less_than_tab spaces
-                        .*\|.*  \n
-                    )+
-                )
-            ''' % (less_than_tab, less_than_tab, less_than_tab), re.M | re.X)
+        table_re = _table_re_from_tab_width(self.tab_width)
         return table_re.sub(self._table_sub, text)
 
     def _wiki_table_sub(self, match):
@@ -907,7 +990,7 @@ class Markdown(object):
         rows = []
         for line in ttext.splitlines(0):
             line = line.strip()[2:-2].strip()
-            row = [c.strip() for c in re.split(r'(?<!\\)\|\|', line)]
+            row = [c.strip() for c in _wiki_cell_split_re.split(line)]
             rows.append(row)
         #pprint(rows)
         hlines = ['<table>', '<tbody>']
@@ -927,12 +1010,7 @@ class Markdown(object):
         if "||" not in text:
             return text
 
-        less_than_tab = self.tab_width - 1
-        wiki_table_re = re.compile(r'''
-            (?:(?<=\n\n)|\A\n?)            # leading blank line
-            ^([ ]{0,%d})\|\|.+?\|\|[ ]*\n  # first line
-            (^\1\|\|.+?\|\|\n)*        # any number of subsequent lines
-            ''' % less_than_tab, re.M | re.X)
+        wiki_table_re = _wiki_table_re_from_tab_width(self.tab_width)
         return wiki_table_re.sub(self._wiki_table_sub, text)
 
     def _run_span_gamut(self, text):
@@ -1417,33 +1495,8 @@ class Markdown(object):
             # types running into each other (see issue #16).
             hits = []
             for marker_pat in (self._marker_ul, self._marker_ol):
-                less_than_tab = self.tab_width - 1
-                whole_list = r'''
-                    (                   # \1 = whole list
-                      (                 # \2
-                        [ ]{0,%d}
-                        (%s)            # \3 = first list item marker
-                        [ \t]+
-                        (?!\ *\3\ )     # '- - - ...' isn't a list. See 'not_quite_a_list' test case.
-                      )
-                      (?:.+?)
-                      (                 # \4
-                          \Z
-                        |
-                          \n{2,}
-                          (?=\S)
-                          (?!           # Negative lookahead for another list item marker
-                            [ \t]*
-                            %s[ \t]+
-                          )
-                      )
-                    )
-                ''' % (less_than_tab, marker_pat, marker_pat)
-                if self.list_level:  # sub-list
-                    list_re = re.compile("^"+whole_list, re.X | re.M | re.S)
-                else:
-                    list_re = re.compile(r"(?:(?<=\n\n)|\A\n?)"+whole_list,
-                                         re.X | re.M | re.S)
+                list_re = _list_re_from_tab_width(self.tab_width, marker_pat,
+                                                  bool(self.list_level))
                 match = list_re.search(text, pos)
                 if match:
                     hits.append((match.start(), match))
@@ -1516,35 +1569,13 @@ class Markdown(object):
         return list_str
 
     def _get_pygments_lexer(self, lexer_name):
-        try:
-            from pygments import lexers, util
-        except ImportError:
-            return None
-        try:
-            return lexers.get_lexer_by_name(lexer_name)
-        except util.ClassNotFound:
-            return None
+        return _pygments_lexer(lexer_name)
 
     def _color_with_pygments(self, codeblock, lexer, **formatter_opts):
         import pygments
-        import pygments.formatters
-
-        class HtmlCodeFormatter(pygments.formatters.HtmlFormatter):
-            def _wrap_code(self, inner):
-                """A function for use in a Pygments Formatter which
-                wraps in <code> tags.
-                """
-                yield 0, "<code>"
-                for tup in inner:
-                    yield tup
-                yield 0, "</code>"
-
-            def wrap(self, source, outfile):
-                """Return the source with a code, pre, and div."""
-                return self._wrap_div(self._wrap_pre(self._wrap_code(source)))
 
         formatter_opts.setdefault("cssclass", "codehilite")
-        formatter = HtmlCodeFormatter(**formatter_opts)
+        formatter = _pygments_formatter(tuple(sorted(formatter_opts.items())))
         return pygments.highlight(codeblock, lexer, formatter)
 
     def _code_block_sub(self, match, is_fenced_code_block=False):
@@ -1584,8 +1615,21 @@ class Markdown(object):
             lexer = self._get_pygments_lexer(lexer_name)
             if lexer:
                 codeblock = unhash_code( codeblock )
-                colored = self._color_with_pygments(codeblock, lexer,
-                                                    **formatter_opts)
+                # Highlighted HTML only depends on the code, the lexer and
+                # the formatter options, so it is shared across conversions.
+                try:
+                    key = (self.__class__, lexer_name,
+                           tuple(sorted(formatter_opts.items())),
+                           md5(codeblock.encode("utf-8")).digest())
+                    hash(key)
+                except TypeError:
+                    key = None
+                colored = key and _highlight_cache.get(key)
+                if not colored:
+                    colored = self._color_with_pygments(codeblock, lexer,
+                                                        **formatter_opts)
+                    if key:
+                        _highlight_cache.set(key, colored)
                 return "\n\n%s\n\n" % colored
 
         codeblock = self._encode_code(codeblock)
@@ -1611,20 +1655,7 @@ class Markdown(object):
 
     def _do_code_blocks(self, text):
         """Process Markdown `<pre><code>` blocks."""
-        code_block_re = re.compile(r'''
-            (?:\n\n|\A\n?)
-            (               # $1 = the code block -- one or more lines, starting with a space/tab
-              (?:
-                (?:[ ]{%d} | \t)  # Lines must start with a tab or a tab-width of spaces
-                .*\n+
-              )+
-            )
-            ((?=^[ ]{0,%d}\S)|\Z)   # Lookahead for non-space at line-start, or end of doc
-            # Lookahead to make sure this block isn't already in a code block.
-            # Needed when syntax highlighting is being used.
-            (?![^<]*\</code\>)
-            ''' % (self.tab_width, self.tab_width),
-            re.M | re.X)
+        code_block_re = _code_block_re_from_tab_width(self.tab_width)
         return code_block_re.sub(self._code_block_sub, text)
 
     _fenced_code_block_re = re.compile(r'''
@@ -2030,6 +2061,101 @@ class UnicodeWithAttrs(unicode):
         return '\n'.join(lines) + '\n'
     toc_html = property(toc_html)
 
+class _LRUCache(object):
+    """A bounded, thread-safe mapping that evicts the least recently used
+    entries once it holds more than `maxsize` of them. Lookups are counted
+    in `hits` and `misses`.
+    If `sizeof` is given, `maxsize` bounds the sum of `sizeof(value)` over
+    all entries instead of their number.
+    """
+    def __init__(self, maxsize, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    def __len__(self):
+        return len(self._data)
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self._data[key]
+    def _sizeof(self, value):
+        return self.sizeof(value) if self.sizeof else 1
+    def set(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self.size -= self._sizeof(self._data[key])
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self.size += self._sizeof(value)
+            while self.size > self.maxsize and self._data:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= self._sizeof(evicted)
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = self.hits = self.misses = 0
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "size": self.size, "maxsize": self.maxsize}
+
+
+_missing = object()
+_memoized_funcs = []
+
+class _memoized(object):
+   """Decorator that caches a function's return value each time it is called.
+   If called later with the same arguments, the cached value is returned, and
+   not re-evaluated.
+   Only the `maxsize` most recently used results are kept, so the cache
+   can't grow without bound in a long-running process. Calls with
+   unhashable arguments are not cached and are counted in `uncachable`.
+   http://wiki.python.org/moin/PythonDecoratorLibrary
+   """
+   def __init__(self, func, maxsize=128):
+      self.func = func
+      self.cache = _LRUCache(maxsize)
+      self.uncachable = 0
+      _memoized_funcs.append(self)
+   def __call__(self, *args):
+      try:
+         value = self.cache.get(args, _missing)
+      except TypeError:
+         # uncachable -- for instance, passing a list as an argument.
+         # Better to not cache than to blow up entirely.
+         self.uncachable += 1
+         return self.func(*args)
+      if value is _missing:
+         value = self.func(*args)
+         self.cache.set(args, value)
+      return value
+   def cache_info(self):
+      info = self.cache.info()
+      info["uncachable"] = self.uncachable
+      return info
+   def __repr__(self):
+      """Return the function's docstring."""
+      return self.func.__doc__
+
+def cache_info():
+    """Return hit/miss statistics of markdown2's internal caches, keyed by
+    function name ("block_cache" for `markdown_blocks()`, "highlight_cache"
+    for Pygments-highlighted code blocks).
+    """
+    info = dict((m.func.__name__, m.cache_info()) for m in _memoized_funcs)
+    info["block_cache"] = _block_cache.info()
+    info["highlight_cache"] = _highlight_cache.info()
+    return info
+
+
 ## {{{ http://code.activestate.com/recipes/577257/ (r1)
 _slugify_strip_re = re.compile(r'[^\w\s-]')
 _slugify_hyphenate_re = re.compile(r'[-\s]+')
@@ -2043,6 +2169,8 @@ def _slugify(value):
     value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode()
     value = _slugify_strip_re.sub('', value).strip().lower()
     return _slugify_hyphenate_re.sub('-', value)
+# Header ids are slugified on every conversion of a document.
+_slugify = _memoized(_slugify, maxsize=1024)
 ## end of http://code.activestate.com/recipes/577257/ }}}
 
 
@@ -2167,28 +2295,141 @@ def _dedent(text, tabsize=8, skip_first_line=False):
     return ''.join(lines)
 
 
-class _memoized(object):
-   """Decorator that caches a function's return value each time it is called.
-   If called later with the same arguments, the cached value is returned, and
-   not re-evaluated.
-   http://wiki.python.org/moin/PythonDecoratorLibrary
-   """
-   def __init__(self, func):
-      self.func = func
-      self.cache = {}
-   def __call__(self, *args):
-      try:
-         return self.cache[args]
-      except KeyError:
-         self.cache[args] = value = self.func(*args)
-         return value
-      except TypeError:
-         # uncachable -- for instance, passing a list as an argument.
-         # Better to not cache than to blow up entirely.
-         return self.func(*args)
-   def __repr__(self):
-      """Return the function's docstring."""
-      return self.func.__doc__
+#---- block-level memoization (see `markdown_blocks()`)
+
+BLOCK_CACHE_SIZE = 4096     # max number of cached block conversions
+_block_cache = _LRUCache(BLOCK_CACHE_SIZE)
+
+# Extras whose output depends on the whole document (numbering, ids,
+# document metadata) rather than on a single block.
+_document_extras = ("footnotes", "toc", "header-ids", "metadata")
+
+_html_block_start_re = re.compile(r"^[ ]{0,3}<", re.M)
+_list_marker_re = re.compile(r"^[ ]{0,3}(?:[*+-]|\d+\.)[ \t]")
+_quote_line_re = re.compile(r"^[ ]{0,3}>")
+_indented_list_start_re = re.compile(r"(?:\A|\n[ \t]*\n)[ ]{1,3}(?:[*+-]|\d+\.)[ \t]")
+_fence_line_re = re.compile(r"^```", re.M)
+
+def _block_convertible(markdowner, text):
+    """Return True if `text` converts to the same HTML block by block."""
+    if markdowner.use_file_vars:
+        return False
+    for extra in _document_extras:
+        if extra in markdowner.extras:
+            return False
+    # Block-level HTML may span blank lines; leave it to a full conversion.
+    if _html_block_start_re.search(text):
+        return False
+    # A top-level list whose first item is indented nests the following
+    # lists, and `_form_paragraphs()` then treats the text after it
+    # differently depending on what follows.
+    return _indented_list_start_re.search(text) is None
+
+def _fence_spans(text):
+    """Return the (start, end) offsets of the fenced code blocks in `text`,
+    from the opening fence line to the end of the closing fence line.
+    """
+    if "```" not in text:
+        return []
+    return [(m.start() + m.group(0).index("```"), min(m.end(), len(text)))
+            for m in Markdown._fenced_code_block_re.finditer(text + "\n\n")]
+
+def _split_blocks(text, fenced=False):
+    """Split markdown text into top-level blocks at blank lines.
+
+    A blank line does not end a block when the next line is indented
+    (a code block or list item continuation), is a list item or quote line
+    after a list or blockquote anywhere since the block's last plain
+    paragraph, or is inside a fenced code block (if `fenced`).
+    """
+    # Find fenced code blocks the way `_do_fenced_code_blocks()` does: an
+    # unclosed fence may pair with a fence further down the document.
+    # Fence lines that don't pair up are matched again later in the block
+    # gamut, so such documents are not split (None is returned).
+    fences = []
+    if fenced:
+        fences = _fence_spans(text)
+        if len(_fence_line_re.findall(text)) != 2 * len(fences):
+            return None
+    blocks = []
+    lines = []
+    blank = False
+    # Kinds of runs ("list", "quote") since the block's last plain
+    # paragraph: a later list item or quote line may still belong to them.
+    runs = set()
+    pos = 0
+    for line in text.split("\n"):
+        start, pos = pos, pos + len(line) + 1
+        if not line.strip():
+            if lines:
+                lines.append("")
+            blank = True
+            continue
+        if blank and lines and not line[0] in " \t":
+            while fences and fences[0][1] <= start:
+                fences.pop(0)
+            continues = ((fences and fences[0][0] < start)
+                or ("quote" in runs and line.startswith(">"))
+                or ("list" in runs and _list_marker_re.match(line)))
+            if not continues:
+                blocks.append("\n".join(lines).rstrip("\n"))
+                lines = []
+                runs = set()
+        if _list_marker_re.match(line):
+            runs.add("list")
+        elif _quote_line_re.match(line):
+            runs.add("quote")
+        elif blank and not line[0] in " \t":
+            runs = set()
+        blank = False
+        lines.append(line)
+    if lines:
+        blocks.append("\n".join(lines).rstrip("\n"))
+    return blocks
+
+
+#---- Pygments support (for the "fenced-code-blocks" and "code-color" extras)
+
+HIGHLIGHT_CACHE_SIZE = 4 * 1024 * 1024  # max total chars of cached code HTML
+_highlight_cache = _LRUCache(HIGHLIGHT_CACHE_SIZE, sizeof=len)
+
+def _pygments_lexer(lexer_name):
+    """Return the Pygments lexer for `lexer_name`, or None."""
+    try:
+        from pygments import lexers, util
+    except ImportError:
+        return None
+    try:
+        return lexers.get_lexer_by_name(lexer_name)
+    except util.ClassNotFound:
+        return None
+_pygments_lexer = _memoized(_pygments_lexer)
+
+def _pygments_formatter(formatter_opts):
+    """Return an HTML formatter for the given (sorted) option items."""
+    import pygments.formatters
+
+    class HtmlCodeFormatter(pygments.formatters.HtmlFormatter):
+        def _wrap_code(self, inner):
+            """A function for use in a Pygments Formatter which
+            wraps in <code> tags.
+            """
+            yield 0, "<code>"
+            for tup in inner:
+                yield tup
+            yield 0, "</code>"
+
+        def wrap(self, source, outfile=None):
+            """Return the source with a code, pre, and div."""
+            source = self._wrap_pre(self._wrap_code(source))
+            if outfile is None:
+                # Pygments >= 2.12 calls `wrap(source)` and adds the div
+                # itself.
+                return source
+            return self._wrap_div(source)
+
+    return HtmlCodeFormatter(**dict(formatter_opts))
+_pygments_formatter = _memoized(_pygments_formatter)
 
 
 def _xml_oneliner_re_from_tab_width(tab_width):
@@ -2231,6 +2472,150 @@ def _hr_tag_re_from_tab_width(tab_width):
         """ % (tab_width - 1), re.X)
 _hr_tag_re_from_tab_width = _memoized(_hr_tag_re_from_tab_width)
 
+#---- regexes that only depend on the tab width
+# These used to be compiled on every call (or per `Markdown` instance);
+# they are built once per tab width and memoized instead.
+
+_extras_splitter_re = re.compile("[ ,]+")
+_line_ending_re = re.compile("\r\n|\r")
+_non_word_re = re.compile(r'\W')
+_wiki_cell_split_re = re.compile(r'(?<!\\)\|\|')
+
+def _outdent_re_from_tab_width(tab_width):
+    return re.compile(r'^(\t|[ ]{1,%d})' % tab_width, re.M)
+_outdent_re_from_tab_width = _memoized(_outdent_re_from_tab_width)
+
+def _link_def_re_from_tab_width(tab_width):
+    """Link definition regex: `[id]: url "optional title"`."""
+    return re.compile(r"""
+        ^[ ]{0,%d}\[(.+)\]: # id = \1
+          [ \t]*
+          \n?               # maybe *one* newline
+          [ \t]*
+        <?(.+?)>?           # url = \2
+          [ \t]*
+        (?:
+            \n?             # maybe one newline
+            [ \t]*
+            (?<=\s)         # lookbehind for whitespace
+            ['"(]
+            ([^\n]*)        # title = \3
+            ['")]
+            [ \t]*
+        )?  # title is optional
+        (?:\n+|\Z)
+        """ % (tab_width - 1), re.X | re.M | re.U)
+_link_def_re_from_tab_width = _memoized(_link_def_re_from_tab_width)
+
+def _footnote_def_re_from_tab_width(tab_width):
+    """Footnote definition regex: `[^note-id]: Text of the note.`"""
+    return re.compile(r'''
+        ^[ ]{0,%d}\[\^(.+)\]:   # id = \1
+        [ \t]*
+        (                       # footnote text = \2
+          # First line need not start with the spaces.
+          (?:\s*.*\n+)
+          (?:
+            (?:[ ]{%d} | \t)  # Subsequent lines must be indented.
+            .*\n+
+          )*
+        )
+        # Lookahead for non-space at line-start, or end of doc.
+        (?:(?=^[ ]{0,%d}\S)|\Z)
+        ''' % (tab_width - 1, tab_width, tab_width),
+        re.X | re.M)
+_footnote_def_re_from_tab_width = _memoized(_footnote_def_re_from_tab_width)
+
+def _pyshell_block_re_from_tab_width(tab_width):
+    """Python interactive shell session regex ('pyshell' extra)."""
+    return re.compile(r"""
+        ^([ ]{0,%d})>>>[ ].*\n   # first line
+        ^(\1.*\S+.*\n)*         # any number of subsequent lines
+        ^\n                     # ends with a blank line
+        """ % (tab_width - 1), re.M | re.X)
+_pyshell_block_re_from_tab_width = _memoized(_pyshell_block_re_from_tab_width)
+
+def _table_re_from_tab_width(tab_width):
+    """PHP-Markdown/GFM table regex ('tables' extra)."""
+    less_than_tab = tab_width - 1
+    return re.compile(r'''
+            (?:(?<=\n\n)|\A\n?)             # leading blank line
+            ^[ ]{0,%d}                      # allowed whitespace
+            (.*[|].*)  \n                   # $1: header row (at least one pipe)
+            ^[ ]{0,%d}                      # allowed whitespace
+            (                               # $2: underline row
+                # underline row with leading bar
+                (?:  \|\ *:?-+:?\ *  )+  \|?  \n
+                |
+                # or, underline row without leading bar
+                (?:  \ *:?-+:?\ *\|  )+  (?:  \ *:?-+:?\ *  )?  \n
+            )
+            (                               # $3: data rows
+                (?:
+                    ^[ ]{0,%d}(?!\ )         # ensure line begins with 0 to less_than_tab spaces
+                    .*\|.*  \n
+                )+
+            )
+        ''' % (less_than_tab, less_than_tab, less_than_tab), re.M | re.X)
+_table_re_from_tab_width = _memoized(_table_re_from_tab_width)
+
+def _wiki_table_re_from_tab_width(tab_width):
+    """Google Code wiki table regex ('wiki-tables' extra)."""
+    return re.compile(r'''
+        (?:(?<=\n\n)|\A\n?)            # leading blank line
+        ^([ ]{0,%d})\|\|.+?\|\|[ ]*\n  # first line
+        (^\1\|\|.+?\|\|\n)*        # any number of subsequent lines
+        ''' % (tab_width - 1), re.M | re.X)
+_wiki_table_re_from_tab_width = _memoized(_wiki_table_re_from_tab_width)
+
+def _code_block_re_from_tab_width(tab_width):
+    """Indented `<pre><code>` block regex."""
+    return re.compile(r'''
+        (?:\n\n|\A\n?)
+        (               # $1 = the code block -- one or more lines, starting with a space/tab
+          (?:
+            (?:[ ]{%d} | \t)  # Lines must start with a tab or a tab-width of spaces
+            .*\n+
+          )+
+        )
+        ((?=^[ ]{0,%d}\S)|\Z)   # Lookahead for non-space at line-start, or end of doc
+        # Lookahead to make sure this block isn't already in a code block.
+        # Needed when syntax highlighting is being used.
+        (?![^<]*\</code\>)
+        ''' % (tab_width, tab_width),
+        re.M | re.X)
+_code_block_re_from_tab_width = _memoized(_code_block_re_from_tab_width)
+
+def _list_re_from_tab_width(tab_width, marker_pat, sub_list):
+    """Whole-list regex for one list marker style. A sub-list may start at
+    any line; a top-level list must follow a blank line or start the doc.
+    """
+    whole_list = r'''
+        (                   # \1 = whole list
+          (                 # \2
+            [ ]{0,%d}
+            (%s)            # \3 = first list item marker
+            [ \t]+
+            (?!\ *\3\ )     # '- - - ...' isn't a list. See 'not_quite_a_list' test case.
+          )
+          (?:.+?)
+          (                 # \4
+              \Z
+            |
+              \n{2,}
+              (?=\S)
+              (?!           # Negative lookahead for another list item marker
+                [ \t]*
+                %s[ \t]+
+              )
+          )
+        )
+    ''' % (tab_width - 1, marker_pat, marker_pat)
+    if sub_list:
+        return re.compile("^"+whole_list, re.X | re.M | re.S)
+    return re.compile(r"(?:(?<=\n\n)|\A\n?)"+whole_list, re.X | re.M | re.S)
+_list_re_from_tab_width = _memoized(_list_re_from_tab_width)
+
 
 def _xml_escape_attr(attr, skip_single_quote=True):
     """Escape the given string for use in an HTML/XML tag attribute.
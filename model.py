@@ -1,7 +1,7 @@
 import time
 import uuid
 
-from orm import Model, StringField, BooleanField, FloatField, TextField
+from orm import Model, Index, StringField, BooleanField, FloatField, TextField
 
 
 def next_id():
@@ -10,8 +10,11 @@ def next_id():
 
 # User,Blog,Comment均继承自Model类，在父类Model中实现了查寻等相关的类方法，比如findAll,countRows,find,
 # update,remove,save等方法
+# __indexes__声明表上的二级索引，应覆盖热点查询的过滤和排序字段，python3 schema.py可生成或比对表结构
 class User(Model):
     __table__ = 'users'
+    # 登录按email查找，用户列表按created_at排序
+    __indexes__ = [Index('email', unique=True), 'created_at']
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     email = StringField(ddl='varchar(50)')
@@ -25,6 +28,8 @@ class User(Model):
 
 class Blog(Model):
     __table__ = 'blogs'
+    # 首页和日志列表按created_at排序
+    __indexes__ = ['created_at']
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     user_id = StringField(ddl='varchar(50)')
@@ -32,18 +37,21 @@ class Blog(Model):
     user_image = StringField(ddl='varchar(500)')
     name = StringField(ddl='varchar(50)')
     summary = StringField(ddl='varchar(200)')
-    content = TextField()
+    # 日志列表页只显示标题和摘要，正文延迟加载
+    content = TextField(deferred=True, ddl='mediumtext')
     created_at = FloatField(default=time.time)
 
 
 class Comment(Model):
     __table__ = 'comments'
+    # 日志页按blog_id查找评论并按created_at排序，复合索引使查询无需全表扫描和额外排序
+    __indexes__ = [('blog_id', 'created_at'), 'created_at']
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     blog_id = StringField(ddl='varchar(50)')
     user_id = StringField(ddl='varchar(50)')
     user_name = StringField(ddl='varchar(50)')
     user_image = StringField(ddl='varchar(500)')
-    content = TextField()
+    content = TextField(ddl='mediumtext')
     created_at = FloatField(default=time.time)
 
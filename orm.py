@@ -1,23 +1,100 @@
+import re
+import sys
+import time
+import asyncio
+import collections
+import operator
 import logging
+import contextlib
+import contextvars
 import aiomysql
 logging.basicConfig(level=logging.INFO)
 
 
 # 定义log函数用于提示log信息,第一部分为数据库中用到的log语句,第二部分为'?'对应的参数
+# 每条语句都会调用，因此使用DEBUG级别，并先判断是否开启DEBUG，未开启时不进入logging.debug；
+# 需要关注的慢查询由_record_query按执行时间单独记录
+_logger = logging.getLogger()
+
+
 def log(sql, args=None):
-    logging.info('SQl: [%s] args: %s' % (sql, args or []))
+    if _logger.isEnabledFor(logging.DEBUG):
+        _logger.debug('SQL: [%s] args: %s', sql, args or [])
+
+
+# 已编译语句缓存: '?'风格的SQL => 驱动使用的'%s'风格SQL
+# 热点查询(Blog.find、User.find、Comment.findAll等)的SQL文本是固定的，转换一次即可反复使用
+_MAX_STATEMENTS = 1024
+_statements = {}
+
+
+def compile_sql(sql):
+    stmt = _statements.get(sql)
+    if stmt is None:
+        # 缓存满时整体清空，防止拼接了字面值的动态SQL使缓存无限增长
+        if len(_statements) >= _MAX_STATEMENTS:
+            _statements.clear()
+        stmt = _statements[sql] = sql.replace('?', '%s')
+    return stmt
+
+
+# 每个Model按语句形式缓存拼接好的SQL(__statements__)，与_statements一样超过_MAX_STATEMENTS条时整体清空，
+# 防止where、orderBy中拼接了字面值时缓存无限增长
+class _StatementCache(dict):
+    __slots__ = ()
+
+    def __setitem__(self, key, sql):
+        if len(self) >= _MAX_STATEMENTS:
+            self.clear()
+        dict.__setitem__(self, key, sql)
+
+# findNumber结果缓存的有效期(秒)。本进程内的写操作会立即使缓存失效，
+# 有效期只用于兜底其他进程的写操作
+COUNT_CACHE_TTL = 60
+
+# 主库连接池，由create_pool创建
+__pool = None
+# 只读副本连接池，select类查询在这些连接池之间分配
+__replicas = []
+# 副本选择策略: 'round-robin'轮流使用，'least-busy'使用正在使用的连接最少的副本
+__replica_policy = 'round-robin'
+__replica_next = 0
 
 async def destroy_pool(): #销毁连接池
-    global __pool
-    if __pool is not None:
-        __pool.close()
-        await  __pool.wait_closed()
+    global __pool, __replicas
+    for pool in [__pool] + __replicas:
+        if pool is not None:
+            pool.close()
+            await pool.wait_closed()
+            _monitors.pop(pool, None)
+    __pool = None
+    __replicas = []
 
+# 主库参数之外，kw['replicas']可以给出只读副本列表，每个副本是一个dict，其中的参数覆盖主库的同名参数，
+# 如replicas=[{'host': 'replica1'}, {'host': 'replica2'}]；kw['replica_policy']为副本选择策略
 async def create_pool(loop, user, password, db, **kw):
     logging.info('create database connection pool ...')
-    global __pool
+    global __pool, __replicas, __replica_policy
     # __xx表示不是一定不能访问，只是python解释器对外把__xx改成_class__name,所以仍可以通过其访问__xx
-    __pool = await aiomysql.create_pool(
+    __pool = await _create_pool(loop, user, password, db, kw)
+    _monitor(__pool, 'primary', kw)
+    __replicas = []
+    for replica in kw.get('replicas') or []:
+        options = dict(kw, user=user, password=password, db=db)
+        options.update(replica)
+        logging.info('create replica connection pool: %s:%s' % (options.get('host', 'localhost'), options.get('port', 3306)))
+        pool = await _create_pool(loop, options.pop('user'), options.pop('password'), options.pop('db'), options)
+        _monitor(pool, 'replica%d' % len(__replicas), options)
+        __replicas.append(pool)
+    __replica_policy = kw.get('replica_policy', 'round-robin')
+    if __replica_policy not in ('round-robin', 'least-busy'):
+        raise ValueError('Invalid replica_policy value: %s' % __replica_policy)
+    global SLOW_QUERY_SECONDS, SLOW_QUERY_EXPLAIN
+    SLOW_QUERY_SECONDS = kw.get('slow_query', SLOW_QUERY_SECONDS)
+    SLOW_QUERY_EXPLAIN = kw.get('explain_slow', SLOW_QUERY_EXPLAIN)
+
+async def _create_pool(loop, user, password, db, kw):
+    return await aiomysql.create_pool(
         # dict.get(key, default=None)
         loop=loop,                              # 传递消息循环对象loop用于异步执行
         user=user,  # 通过关键字参数传递user
@@ -29,36 +106,461 @@ async def create_pool(loop, user, password, db, **kw):
         autocommit=kw.get('autocommit', True),  # 默认自动提交事务
         maxsize=kw.get('maxsize', 10),          # 连接池最多同时处理10个请求
         minsize=kw.get('minsize', 1),           # 连接池最少处理1个请求
+        pool_recycle=kw.get('pool_recycle', -1),  # 空闲连接超过该秒数后关闭重建，-1表示不回收
     )
 
+
+# 自适应连接数的调整周期(秒)，以及周期内平均等待时间超过多少秒时增加一个连接
+POOL_ADJUST_INTERVAL = 10
+POOL_GROW_WAIT = 0.005
+
+
+# 连接池监控: 记录取连接的等待时间、正在使用和空闲的连接数、连接占用时间
+# 每次取连接都要计时，有一定开销，因此只在monitor=True或adaptive=True时记录(active)；
+# 否则直接使用连接池，统计中只有连接池自身的连接数
+# adaptive=True时在[minsize, maxsize]之间调整同时使用的连接数上限limit，从maxsize开始:
+# 一个周期内使用的连接数峰值比limit少2个以上则减一，取连接的平均等待时间超过POOL_GROW_WAIT则加一。
+# 这只是连接池前面的并发限制，连接池本身仍按maxsize创建，减少limit不会关闭已建立的连接
+class PoolMonitor(object):
+    def __init__(self, name, pool, minsize=1, maxsize=10, adaptive=False, monitor=False):
+        self.name = name
+        self.pool = pool
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.adaptive = adaptive
+        self.active = monitor or adaptive
+        self.limit = maxsize
+        self.in_use = 0         # 正在使用的连接数
+        self.waiting = 0        # 正在等待连接的协程数，包括在连接池中等待空闲连接的
+        self.acquires = 0       # 取连接的总次数
+        self.wait_time = 0.0    # 取连接的总等待时间
+        self.wait_max = 0.0
+        self.hold_time = 0.0    # 连接被占用的总时间
+        self._admitted = 0      # 已占用名额的协程数: 正在使用连接的和通过名额限制后正在从连接池取连接的
+        self._waiters = collections.deque()
+        self._window = (time.monotonic(), 0, 0.0, 0)   # 调整周期开始时间, 取连接次数, 等待时间, 使用峰值
+
+    # 开始取连接并占用一个连接名额，返回开始等待的时间；自适应模式下名额用完时返回None，
+    # 调用者需要await wait()排队。从调用到acquired()(取到连接)或release()(没有取到连接)之前都计入waiting
+    def acquire(self):
+        self.waiting += 1
+        if self.adaptive and self._admitted >= self.limit:
+            return None
+        self._admitted += 1
+        return time.monotonic()
+
+    async def wait(self):
+        start = time.monotonic()
+        try:
+            while self._admitted >= self.limit:
+                waiter = asyncio.get_event_loop().create_future()
+                self._waiters.append(waiter)
+                await waiter
+        except BaseException:
+            self.waiting -= 1
+            # 被取消时可能已经被唤醒，把这次唤醒转给下一个等待者
+            self._wakeup()
+            raise
+        self._admitted += 1
+        return start
+
+    def acquired(self, start):
+        now = time.monotonic()
+        self.waiting -= 1
+        self.in_use += 1
+        wait = now - start
+        self.acquires += 1
+        self.wait_time += wait
+        if wait > self.wait_max:
+            self.wait_max = wait
+        if self.adaptive:
+            began, count, waited, peak = self._window
+            self._window = (began, count + 1, waited + wait, max(peak, self.in_use))
+            if now - began >= POOL_ADJUST_INTERVAL:
+                self._adjust(now)
+        return now
+
+    # 归还连接名额，acquired为None表示没有取到连接(从连接池取连接时出错或被取消)
+    def release(self, acquired):
+        self._admitted -= 1
+        if acquired is None:
+            self.waiting -= 1
+        else:
+            self.hold_time += time.monotonic() - acquired
+            self.in_use -= 1
+        if self._waiters:
+            self._wakeup()
+
+    def _wakeup(self):
+        while self._waiters and self._admitted < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def _adjust(self, now):
+        began, count, waited, peak = self._window
+        self._window = (now, 0, 0.0, self.in_use)
+        if count and waited / count > POOL_GROW_WAIT and self.limit < self.maxsize:
+            self.limit += 1
+            logging.info('pool %s: grow limit to %s' % (self.name, self.limit))
+            self._wakeup()
+        elif peak < self.limit - 2 and self.limit > self.minsize:
+            self.limit -= 1
+            logging.info('pool %s: shrink limit to %s' % (self.name, self.limit))
+
+    def snapshot(self):
+        if not self.active:
+            return {
+                'name': self.name,
+                'size': getattr(self.pool, 'size', None),
+                'free': getattr(self.pool, 'freesize', None),
+                'in_use': _busy(self.pool),
+                'maxsize': self.maxsize,
+            }
+        return {
+            'name': self.name,
+            'size': getattr(self.pool, 'size', None),           # 已建立的连接数
+            'free': getattr(self.pool, 'freesize', None),       # 空闲的连接数
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'limit': self.limit,
+            'minsize': self.minsize,
+            'maxsize': self.maxsize,
+            'acquires': self.acquires,
+            'wait_avg': self.wait_time / self.acquires if self.acquires else 0.0,
+            'wait_max': self.wait_max,
+            'hold_avg': self.hold_time / self.acquires if self.acquires else 0.0,
+        }
+
+
+# 连接池 => 监控对象，每次取连接都要查找，用普通dict，由destroy_pool删除
+_monitors = {}
+
+
+# 取得连接池的监控对象，不存在时按kw中的minsize、maxsize、adaptive、monitor创建
+def _monitor(pool, name=None, kw=None):
+    monitor = _monitors.get(pool)
+    if monitor is None:
+        kw = kw or {}
+        monitor = _monitors[pool] = PoolMonitor(name or 'pool', pool, kw.get('minsize', 1), kw.get('maxsize', 10),
+                                                kw.get('adaptive', False), kw.get('monitor', False))
+    return monitor
+
+
+# 连接池正在使用的连接数(包括等待连接的)，用于least-busy选择副本
+def _busy(pool):
+    monitor = _monitors.get(pool)
+    if monitor is not None and monitor.active:
+        return monitor.in_use + monitor.waiting
+    return pool.size - pool.freesize
+
+
+# SQL语句的执行统计: 执行次数、总耗时、最长耗时(秒)，只统计驱动执行和取结果的时间
+_queries = {'count': 0, 'time': 0.0, 'max': 0.0}
+
+
+# 执行时间超过SLOW_QUERY_SECONDS秒的语句记为慢查询，写WARNING日志并按指纹汇总；
+# SLOW_QUERY_EXPLAIN为True时，每个指纹第一次变慢时在后台执行一次EXPLAIN并保存结果
+SLOW_QUERY_SECONDS = 0.1
+SLOW_QUERY_EXPLAIN = False
+_MAX_SLOW_QUERIES = 256
+_slow_queries = {}
+# 正在后台执行的EXPLAIN任务，事件循环只保存任务的弱引用，需要在这里保留到任务结束
+_explaining = set()
+
+# SQL指纹: 字面值替换为?，IN列表合并为(?+)，空白合并，参数不同的同一类查询得到同一个指纹
+_FINGERPRINT = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\""), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?+)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    for pattern, repl in _FINGERPRINT:
+        sql = pattern.sub(repl, sql)
+    return sql.strip()
+
+
+# 发出查询的调用位置: 调用栈上第一个不在orm.py中的帧
+def _call_site():
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return None
+    return '%s:%s %s' % (frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+
+
+def _record_query(sql, args, elapsed):
+    _queries['count'] += 1
+    _queries['time'] += elapsed
+    if elapsed > _queries['max']:
+        _queries['max'] = elapsed
+    if elapsed >= SLOW_QUERY_SECONDS:
+        _slow_query(sql, args, elapsed)
+
+
+def _slow_query(sql, args, elapsed):
+    site = _call_site()
+    logging.warning('slow query (%.3fs) at %s: [%s] args: %s', elapsed, site, sql, args or [])
+    key = fingerprint(sql)
+    entry = _slow_queries.get(key)
+    if entry is None:
+        if len(_slow_queries) >= _MAX_SLOW_QUERIES:
+            return
+        entry = _slow_queries[key] = {'fingerprint': key, 'sql': sql, 'count': 0, 'time': 0.0,
+                                      'max': 0.0, 'call_site': site, 'explain': None}
+        if SLOW_QUERY_EXPLAIN and key.lstrip('( ').upper().startswith('SELECT'):
+            task = asyncio.ensure_future(_explain(entry, sql, args))
+            _explaining.add(task)
+            task.add_done_callback(_explaining.discard)
+    entry['count'] += 1
+    entry['time'] += elapsed
+    if elapsed > entry['max']:
+        entry['max'] = elapsed
+        entry['sql'] = sql
+        entry['call_site'] = site
+
+
+# 在独立的连接上执行EXPLAIN，不使用当前事务的连接(事务中的连接同一时间只能执行一条语句)
+async def _explain(entry, sql, args):
+    try:
+        async with _read_pool().get() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute('EXPLAIN ' + compile_sql(sql), args)
+                entry['explain'] = await cur.fetchall()
+        logging.warning('explain [%s]: %s', entry['fingerprint'], entry['explain'])
+    except Exception as e:
+        logging.warning('explain failed [%s]: %s', entry['fingerprint'], e)
+
+
+# 慢查询汇总，按总耗时从高到低排列
+def slow_queries():
+    return sorted(_slow_queries.values(), key=lambda e: e['time'], reverse=True)
+
+
+# 连接池和SQL执行的统计快照，可用于监控页面或定期写日志
+def pool_stats():
+    pools = [__pool] + __replicas
+    count = _queries['count']
+    return {
+        'pools': [_monitor(pool).snapshot() for pool in pools if pool is not None],
+        'queries': {
+            'count': count,
+            'avg': _queries['time'] / count if count else 0.0,
+            'max': _queries['max'],
+        },
+    }
+
+# 选择执行只读查询的连接池
+def _read_pool():
+    global __replica_next
+    if not __replicas or time.time() - _wrote.get() < REPLICA_STICKY_SECONDS:
+        return __pool
+    if __replica_policy == 'least-busy':
+        return min(__replicas, key=_busy)
+    __replica_next = (__replica_next + 1) % len(__replicas)
+    return __replicas[__replica_next]
+
+# 当前协程所在的事务，由transaction()设置；事务中的所有ORM调用都使用事务的连接
+_transaction = contextvars.ContextVar('transaction', default=None)
+# 当前请求(协程)最后一次写主库的时间；此后REPLICA_STICKY_SECONDS秒内的读也发往主库，
+# 保证能读到自己刚写入的数据(副本复制有延迟)
+REPLICA_STICKY_SECONDS = 5
+_wrote = contextvars.ContextVar('wrote', default=0)
+
+
+class Transaction(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.depth = 0      # 嵌套的保存点层数
+
+
+# 取得执行SQL的连接: 在事务中使用事务固定的连接，否则从连接池取出，用完放回
+# readonly=True的只读查询可以发往只读副本，其余语句都在主库执行
+# 每条语句都要经过这里，因此返回直接实现的异步上下文管理器，而不是每次创建生成器的asynccontextmanager
+def connection(readonly=False):
+    tx = _transaction.get()
+    if tx is not None:
+        return _TransactionConnection(tx.conn)
+    if readonly:
+        pool = _read_pool()
+    else:
+        _wrote.set(time.time())
+        pool = __pool
+    monitor = _monitors.get(pool)
+    if monitor is None or not monitor.active:
+        return pool.get()
+    return _PooledConnection(pool, monitor)
+
+
+class _TransactionConnection(object):
+    __slots__ = ('conn',)
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+# 从连接池取出连接，并记录到连接池的监控对象
+class _PooledConnection(object):
+    __slots__ = ('pool', 'monitor', 'ctx', 'acquired')
+
+    def __init__(self, pool, monitor):
+        self.pool = pool
+        self.monitor = monitor
+        self.ctx = None
+        self.acquired = None
+
+    async def __aenter__(self):
+        monitor = self.monitor
+        start = monitor.acquire()
+        if start is None:
+            start = await monitor.wait()
+        try:
+            self.ctx = self.pool.get()
+            conn = await self.ctx.__aenter__()
+        except BaseException:
+            monitor.release(None)
+            raise
+        self.acquired = monitor.acquired(start)
+        return conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self.ctx.__aexit__(exc_type, exc, tb)
+        finally:
+            self.monitor.release(self.acquired)
+
+
+async def _execute_on(conn, sql):
+    log(sql)
+    async with conn.cursor() as cur:
+        start = time.monotonic()
+        await cur.execute(sql)
+        _record_query(sql, None, time.monotonic() - start)
+
+
+# 显式事务: async with transaction(): 块中的save()、update()、remove()、findAll()等调用
+# 都使用同一个连接，正常结束时提交，抛出异常时回滚；嵌套使用时以保存点(SAVEPOINT)实现，
+# 内层出错只回滚到内层开始的位置。事务中不要并发执行多个查询(如asyncio.gather)，它们共用一个连接
+@contextlib.asynccontextmanager
+async def transaction():
+    tx = _transaction.get()
+    if tx is not None:
+        tx.depth += 1
+        savepoint = 'sp%d' % tx.depth
+        await _execute_on(tx.conn, 'SAVEPOINT %s' % savepoint)
+        try:
+            yield tx
+        except BaseException:
+            await _execute_on(tx.conn, 'ROLLBACK TO SAVEPOINT %s' % savepoint)
+            raise
+        else:
+            await _execute_on(tx.conn, 'RELEASE SAVEPOINT %s' % savepoint)
+        finally:
+            tx.depth -= 1
+        return
+    _wrote.set(time.time())
+    async with connection() as conn:
+        await conn.begin()
+        tx = Transaction(conn)
+        token = _transaction.set(tx)
+        try:
+            yield tx
+        except BaseException:
+            await conn.rollback()
+            raise
+        else:
+            await conn.commit()
+        finally:
+            _transaction.reset(token)
+
+
 # 作用于SQL的SELECT语句，对应select语句，传入sql语句和参数
 async def select(sql, args, size=None):
     log(sql, args)
     # 异步等待连接池对象返回可以连接的线程，with语句则封装了关闭conn和处理异常的工作
-    async with __pool.get() as conn:
+    async with connection(readonly=True) as conn:
         # 等待连接对象返回DictCursor,可以通过dict的方式获取数据库对象，需要通过游标对象执行SQL
         async with conn.cursor(aiomysql.DictCursor) as cur:
-            # 将sql中的'?'替换为'%s'，因为mysql语句中的占位符为%s
-            await cur.execute(sql.replace('?', '%s'), args)
+            # 将sql中的'?'替换为'%s'，因为mysql语句中的占位符为%s，转换结果由compile_sql缓存
+            start = time.monotonic()
+            await cur.execute(compile_sql(sql), args)
             if size:   # 如果传入的为size,取出指定行数的结果
                 resultset = await cur.fetchmany(size)
             else:
                 resultset = await cur.fetchall()  # 否则取出所有结果
-        logging.info('row returned: %s' % len(resultset))
+            _record_query(sql, args, time.monotonic() - start)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('row returned: %s', len(resultset))
         return resultset
 
 
+# 与select相同，但使用普通游标，每行是一个tuple而不是dict，返回(列名tuple, 结果集)
+# 列名只从cursor.description解析一次，由调用者按列顺序直接构造对象，省去每行一个中间dict
+async def select_rows(sql, args, size=None):
+    log(sql, args)
+    async with connection(readonly=True) as conn:
+        async with conn.cursor() as cur:
+            start = time.monotonic()
+            await cur.execute(compile_sql(sql), args)
+            if size:
+                resultset = await cur.fetchmany(size)
+            else:
+                resultset = await cur.fetchall()
+            _record_query(sql, args, time.monotonic() - start)
+            names = tuple([d[0] for d in cur.description])
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('row returned: %s', len(resultset))
+        return names, resultset
+
+
+# 流式查询: 使用无缓冲的服务端游标(SSCursor)，每次从服务器取size行，逐批产生(列名tuple, 结果集)
+# 整个遍历过程中占用一个连接，适合遍历大表而不把整个结果集读入内存
+# 不能在transaction()中使用: 遍历结束前事务的连接上一直有未读完的结果，其他语句都无法执行
+async def select_stream(sql, args, size=500):
+    if _transaction.get() is not None:
+        raise ValueError('select_stream() cannot be used inside transaction()')
+    log(sql, args)
+    async with connection(readonly=True) as conn:
+        async with conn.cursor(aiomysql.SSCursor) as cur:
+            # 流式查询只统计执行语句到返回第一批结果的时间，不包括调用者处理每批结果的时间
+            start = time.monotonic()
+            await cur.execute(compile_sql(sql), args)
+            _record_query(sql, args, time.monotonic() - start)
+            names = tuple([d[0] for d in cur.description])
+            while True:
+                resultset = await cur.fetchmany(size)
+                if not resultset:
+                    break
+                yield names, resultset
+
+
 # 用于SQL的INSERT、INTO、UPDATE、DELETE语句，execute方法只返回结果数，不返回结果集
 async def execute(sql, args, autocommit=True):
     log(sql, args)
     # with函数调用进程池，调用with函数后自动调用关闭进程池函数
-    async with __pool.get() as conn:
+    async with connection() as conn:
+        # 已在transaction()中时由事务统一提交
+        if _transaction.get() is not None:
+            autocommit = True
         if not autocommit:  # 若数据库的事务为非自动提交的，则调用协程启动连接
             await conn.begin()
         try:
             # 打开一个DictCursor,他与普通游标不同之处在于，以dict形式返回结果
             async with conn.cursor(aiomysql.DictCursor) as cur:
-                await cur.execute(sql.replace('?', '%s'), args)
+                start = time.monotonic()
+                await cur.execute(compile_sql(sql), args)
+                _record_query(sql, args, time.monotonic() - start)
                 affected = cur.rowcount  # 返回受影响的行数
             if not autocommit:
                 await conn.commit()
@@ -69,6 +571,21 @@ async def execute(sql, args, autocommit=True):
         return affected
 
 
+# 在同一个连接、同一个事务中依次执行多条INSERT、UPDATE、DELETE语句，返回受影响的总行数
+# 任意一条出错则整体回滚；已在transaction()中时作为一个保存点执行
+async def execute_batch(statements):
+    async with transaction() as tx:
+        affected = 0
+        async with tx.conn.cursor(aiomysql.DictCursor) as cur:
+            for sql, args in statements:
+                log(sql, args)
+                start = time.monotonic()
+                await cur.execute(compile_sql(sql), args)
+                _record_query(sql, args, time.monotonic() - start)
+                affected += cur.rowcount
+        return affected
+
+
 # 这是一个元类,它定义了如何来构造一个类,任何定义了__metaclass__属性或指定了metaclass的都会通过元类定义的构造方法构造类
 # 任何继承自Model的类,都会自动通过ModelMetaclass扫描映射关系,并存储到自身的类属性
 class ModelMetaclass(type):
@@ -80,12 +597,15 @@ class ModelMetaclass(type):
         # 排除Model类本身,因为Model类主要就是用来被继承的,其不存在与数据库表的映射
         if name == 'Model':
             return type.__new__(cls, name, bases, attrs)
+        # 子类不再创建实例__dict__，从数据库加载的每一行只占用dict本身和Model.__slots__
+        attrs.setdefault('__slots__', ())
         # 找到表名，若没有定义__table__属性,将类名作为表名
         tablename = attrs.get('__table__', name)
         logging.info('found model: %s (table: %s)' % (name, tablename))
         # 建立映射关系表和找到主键
         mappings = {}   # 保存映射关系
         escaped_fields = []         # 保存所有字段名
+        deferred_fields = []        # 保存延迟加载的字段名，列表查询默认不选出这些字段
         primary_key = None  # 保存主键
 
         # 遍历类的属性,找出定义的域(如StringField,字符串域)内的值,建立映射关系
@@ -103,6 +623,8 @@ class ModelMetaclass(type):
                     primary_key = key
                 else:
                     escaped_fields.append(key)  # 将非主键的属性名都保存到escaped_fields
+                    if val.deferred:
+                        deferred_fields.append(key)
         if not primary_key:  # 没有主键也将报错
             raise KeyError('Primary key not found. ')
 
@@ -110,24 +632,115 @@ class ModelMetaclass(type):
         attrs['__table__'] = tablename                          # 映射关系表
         attrs['__primary_key__'] = primary_key                 # 主键属性名
         attrs['__fields__'] = escaped_fields + [primary_key]    # 将所有属性名都添加进__fields__属性中
+        attrs['__deferred__'] = deferred_fields                 # 延迟加载的字段名
+        # 游标(keyset)分页使用的排序键，默认为(created_at, 主键)
+        if '__seek__' not in attrs:
+            attrs['__seek__'] = ('created_at', primary_key) if 'created_at' in mappings else (primary_key,)
+        # 表上的二级索引，每项可以是字段名、字段名tuple(复合索引)或Index对象，统一转换为Index
+        indexes = []
+        for index in attrs.get('__indexes__', ()):
+            if isinstance(index, str):
+                index = Index(index)
+            elif not isinstance(index, Index):
+                index = Index(*index)
+            for f in index.fields:
+                if f not in mappings:
+                    raise KeyError('Index %s of %s uses unknown field: %s' % (index.name, name, f))
+            indexes.append(index)
+        attrs['__indexes__'] = indexes
 
         # --------------------默认SQL语句------------------------------------
         # 默认select选出主键
         attrs['__select__'] = 'SELECT * FROM `%s`' % (tablename)
+        # 列表查询(findAll)默认选出的列，不包含延迟加载的字段；总是列出映射的列而不用SELECT *，
+        # 表中多出未映射的列时compact=True的Record(按__slots__赋值)也不会出错
+        attrs['__select_list__'] = 'SELECT %s FROM `%s`' % (', '.join('`%s`' % f for f in mappings if f not in deferred_fields), tablename)
         attrs['__insert__'] = 'INSERT INTO `%s` (%s) VALUES (%s)' % (tablename, ', '.join('`%s`' % f for f in mappings), ', '.join('?' * len(mappings)))
         attrs['__update__'] = 'UPDATE `%s` SET %s WHERE `%s` = ?' % (tablename,
                                                                  ', '.join('`%s` = ?' % f for f in escaped_fields), primary_key)
         attrs['__delete__'] = 'DELETE FROM `%s` WHERE `%s`= ?' % (tablename,
                                                               primary_key)
-        return type.__new__(cls, name, bases, attrs)
+        # 多行INSERT中每一行的占位符，如'(?, ?, ?)'
+        attrs['__insert_row__'] = '(%s)' % ', '.join('?' * len(mappings))
+        attrs['__find__'] = '%s WHERE `%s`= ?' % (attrs['__select__'], primary_key)
+        # findAll按(where, orderBy, limit形式, 选出的字段)缓存拼好的SQL，避免每次请求重新拼接
+        attrs['__statements__'] = _StatementCache()
+        # findNumber的结果缓存: (selectField, where, args, approximate) => (结果, 过期时间)
+        attrs['__counts__'] = {}
+        # 缓存失效的次数，findNumber查询期间发生写操作时不缓存查询结果
+        attrs['__count_generation__'] = 0
+        # update()、remove()成功后依次调用的监听函数，参数为被修改的实例
+        attrs['__listeners__'] = []
+        model = type.__new__(cls, name, bases, attrs)
+        # 紧凑的只读行类型，字段顺序与__fields__相同，findAll(compact=True)时使用
+        fields = tuple(attrs['__fields__'])
+        model.__record__ = type('%sRecord' % name, (Record,), {
+            '__slots__': fields,
+            '__model__': model,
+            # 一次取出所有字段值，用于快速转换为dict
+            '_values': operator.attrgetter(*fields) if len(fields) > 1 else (lambda r: (getattr(r, fields[0]),)),
+        })
+        return model
+
+
+# 紧凑的行对象: 字段保存在__slots__中，没有Model每行一个dict以及__getattr__异常路径的开销
+# 适合只读的列表查询，可在Jinja2模板中按属性访问，也可以序列化为JSON(见serializer)
+# 未选出的字段不存在，访问时抛出AttributeError；不支持save()、update()、load()等操作
+class Record(object):
+    __slots__ = ()
+
+    def __init__(self, **kw):
+        for k, v in kw.items():
+            setattr(self, k, v)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    # 转换为dict，只包含已有值的字段
+    def _asdict(self):
+        try:
+            return dict(zip(self.__slots__, self._values(self)))
+        except AttributeError:
+            pass
+        d = {}
+        for f in self.__slots__:
+            try:
+                d[f] = getattr(self, f)
+            except AttributeError:
+                pass
+        return d
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join('%s=%r' % kv for kv in self._asdict().items()))
+
+
+# 从数据库加载后没有被修改过的实例共用的空集合
+_CLEAN = frozenset()
 
 
 # ORM映射基类,继承自dict,通过ModelMetaclass元类来构造类
 class Model(dict, metaclass=ModelMetaclass):
 
+    # 不属于数据库字段的内部状态: _dirty为加载后被修改过的字段，_siblings为同一次查询得到的实例列表
+    __slots__ = ('_dirty', '_siblings')
+
     # 初始化函数,调用其父类(dict)的方法
     def __init__(self, **kw):
         super(Model, self).__init__(**kw)
+        _set_dirty(self, None)
+        _set_siblings(self, None)
+
+    # 复制和反序列化时直接恢复__slots__中的内部状态，不经过__setattr__写成dict的键
+    def __setstate__(self, state):
+        _, slots = state
+        for key, value in (slots or {}).items():
+            object.__setattr__(self, key, value)
 
     # 增加__getattr__方法，使获取属性更加简单,即可通过"a.b"的形式
     # 动态调用不存在的属性key时,将会调用__getattr__(self,'attr')来尝试获得属性
@@ -136,12 +749,25 @@ class Model(dict, metaclass=ModelMetaclass):
         try:
             return self[attr]
         except KeyError:
+            if attr in self.__deferred__:
+                raise AttributeError(r"deferred field '%s' is not loaded, call load() first" % attr)
             raise AttributeError(r"'Model' object has no attribute '%s'" % attr)
 
     # 增加__setattr__方法,使设置属性更方便,可通过"a.b=c"的形式
     def __setattr__(self, attr, value):
         self[attr] = value
 
+    # 记录从数据库加载后被修改过的字段，update()只更新这些字段
+    # 直接构造的实例没有_dirty，不做记录
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        dirty = getattr(self, '_dirty', None)
+        if dirty is not None:
+            if dirty is _CLEAN:
+                _set_dirty(self, {key})
+            else:
+                dirty.add(key)
+
     # 通过键取值,若值不存在,则取默认值
     def getValueOrDefault(self, key):
         value = getattr(self, key, None)
@@ -158,33 +784,198 @@ class Model(dict, metaclass=ModelMetaclass):
     # classmethod装饰器将方法定义为类方法
     # 对于查询相关的操作,我们都定义为类方法,就可以方便查询,而不必先创建实例再查询
     # 查找所有合乎条件的信息
+    # fields指定要选出的字段(主键总会被选出)，未指定时选出除延迟加载字段以外的所有字段
+    # compact=True时返回紧凑的只读Record对象而不是Model实例
+    # 游标分页: after/before为__seek__排序键的值，如(created_at, id)，只返回排在该位置之后/之前的记录，
+    # 空元组表示从头开始；desc=True时按排序键倒序排列。游标分页时不能再指定orderBy
     @classmethod
-    async def findAll(cls, where=None, args=None, **kw):
+    async def findAll(cls, where=None, args=None, fields=None, **kw):
         ' find objects by where clause. '
-        # 初始化SQL语句和参数列表
-        sql = [cls.__select__]
+        sql, args, fields, reverse = cls._prepareSelect(where, args, fields, kw)
+        names, resultset = await select_rows(sql, args)   # 没有指定size,因此会fetchall
+        if kw.get('compact'):
+            results = cls._fromRows(names, resultset, compact=True)
+            if reverse:
+                results.reverse()
+            return results
+        results = cls._fromRows(names, resultset)            # 返回结果，结果是list对象，里面的元素是Model实例
+        if reverse:
+            results.reverse()
+        if results and (fields is not None or cls.__deferred__):
+            # 同一次查询得到的实例共享同一个列表，之后load()可以一次查询为所有实例补齐缺少的字段
+            for r in results:
+                _set_siblings(r, results)
+        return results
+
+    # 流式查询: 参数与findAll相同，通过服务端游标每次取batch行，逐个产生实例，内存占用与batch成正比
+    # 用于导出、重建索引等需要遍历整张表的任务: async for blog in Blog.stream(batch=500)；不能在transaction()中使用
+    @classmethod
+    async def stream(cls, where=None, args=None, fields=None, batch=500, **kw):
+        if kw.get('before') is not None:
+            raise ValueError('before cannot be used with stream()')
+        sql, args, fields, reverse = cls._prepareSelect(where, args, fields, kw)
+        async for names, resultset in select_stream(sql, args, batch):
+            results = cls._fromRows(names, resultset)
+            if fields is not None or cls.__deferred__:
+                # 同一批的实例共享同一个列表，load()可以一次查询补齐整批实例缺少的字段
+                for r in results:
+                    _set_siblings(r, results)
+            for r in results:
+                yield r
+
+    # 按列名顺序把tuple结果集直接转换为Model实例(compact=True时为Record)，不经过中间dict
+    @classmethod
+    def _fromRows(cls, names, resultset, compact=False):
+        if compact:
+            record = cls.__record__
+            new = record.__new__
+            # 每一列对应的slot赋值函数，每条语句只解析一次
+            setters = [getattr(record, n).__set__ for n in names]
+            results = []
+            for row in resultset:
+                r = new(record)
+                for setter, value in zip(setters, row):
+                    setter(r, value)
+                results.append(r)
+            return results
+        new = dict.__new__
+        update = dict.update
+        results = []
+        for row in resultset:
+            r = new(cls)
+            update(r, zip(names, row))
+            # 标记为从数据库加载，之后开始记录被修改的字段
+            _set_dirty(r, _CLEAN)
+            _set_siblings(r, None)
+            results.append(r)
+        return results
+
+    # 根据findAll的参数生成SQL语句和参数列表，返回(sql, args, fields, 结果是否需要翻转)
+    @classmethod
+    def _prepareSelect(cls, where, args, fields, kw):
+        if fields is not None:
+            fields = tuple(fields)
         if args is None:
             args = []
+        orderBy = kw.get('orderBy')
+        after = kw.get('after')
+        before = kw.get('before')
+        seek = None
+        reverse = False
+        if after is not None or before is not None:
+            if orderBy is not None:
+                raise ValueError('orderBy cannot be used with after/before')
+            if after is not None and before is not None:
+                raise ValueError('after and before cannot be used together')
+            cursor = tuple(after if after is not None else before)
+            if cursor and len(cursor) != len(cls.__seek__):
+                raise ValueError('Invalid cursor value: %s' % (cursor,))
+            # 取某位置之前的记录时反向扫描，查询后再翻转回原来的顺序
+            reverse = before is not None
+            seek = (kw.get('desc', False) == reverse, bool(cursor))
+            if cursor:
+                args.extend(cls._seekArgs(cursor))
+            if fields is not None:
+                fields = fields + tuple(f for f in cls.__seek__ if f not in fields)
+        # LIMIT 是筛选结果集的关键字
+        limit = kw.get('limit')
+        if limit is None:
+            shape = 0
+        elif isinstance(limit, int):
+            shape = 1
+            args.append(limit)
+        elif isinstance(limit, tuple) and len(limit) == 2:
+            shape = 2
+            args.extend(limit)
+        else:
+            raise ValueError('Invalid limit value: %s' % limit)
+        key = (where, orderBy, shape, fields, seek)
+        sql = cls.__statements__.get(key)
+        if sql is None:
+            sql = cls.__statements__[key] = cls._buildSelect(where, orderBy, shape, fields, seek)
+        return sql, args, fields, reverse
+
+    # 按findAll的参数形式拼接SQL语句，结果由findAll缓存在__statements__中
+    @classmethod
+    def _buildSelect(cls, where, orderBy, shape, fields=None, seek=None):
+        # 初始化SQL语句
+        sql = [cls._buildColumns(fields)]
+        if seek is not None:
+            ascending, has_cursor = seek
+            orderBy = ', '.join('`%s` %s' % (f, 'ASC' if ascending else 'DESC') for f in cls.__seek__)
+            if has_cursor:
+                condition = cls._seekCondition('>' if ascending else '<')
+                where = '(%s) AND %s' % (where, condition) if where else condition
         # WHERE查找条件的关键字
         if where:
             sql.append('WHERE ')
             sql.append(where)
         # ORDER BY是排序的关键字
-        if kw.get('orderBy') is not None:
-            sql.append('ORDER BY %s' % (kw['orderBy']))
-        # LIMIT 是筛选结果集的关键字
-        limit = kw.get('limit')
-        if limit is not None:
-            if isinstance(limit, int):
-                sql.append('LIMIT ?')
-                args.append(limit)
-            elif isinstance(limit, tuple) and len(limit) == 2:
-                sql.append('LIMIT ?, ?')
-                args.extend(limit)
-            else:
-                raise ValueError('Invalid limit value: %s' % limit)
-        resultset = await select(' '.join(sql), args)   # 调用前面定义的select函数，没有指定size,因此会fetchall
-        return [cls(**r) for r in resultset]            # 返回结果，结果是list对象，里面的元素是dict类型的
+        if orderBy is not None:
+            sql.append('ORDER BY %s' % orderBy)
+        if shape == 1:
+            sql.append('LIMIT ?')
+        elif shape == 2:
+            sql.append('LIMIT ?, ?')
+        return ' '.join(sql)
+
+    # 排序键(a, b)排在游标之后的条件: (`a` > ? OR (`a` = ? AND `b` > ?))
+    @classmethod
+    def _seekCondition(cls, op):
+        terms = []
+        for i, f in enumerate(cls.__seek__):
+            equals = ['`%s` = ?' % e for e in cls.__seek__[:i]]
+            terms.append(' AND '.join(equals + ['`%s` %s ?' % (f, op)]))
+        return '(%s)' % ' OR '.join('(%s)' % t if ' AND ' in t else t for t in terms)
+
+    # 与_seekCondition中占位符顺序对应的参数
+    @classmethod
+    def _seekArgs(cls, cursor):
+        args = []
+        for i in range(len(cursor)):
+            args.extend(cursor[:i + 1])
+        return args
+
+    # 生成SELECT ... FROM部分，fields为None时使用默认的列表查询列
+    @classmethod
+    def _buildColumns(cls, fields):
+        if fields is None:
+            return cls.__select_list__
+        for f in fields:
+            if f not in cls.__mappings__:
+                raise ValueError('Invalid field for %s: %s' % (cls.__name__, f))
+        columns = [cls.__primary_key__] + [f for f in fields if f != cls.__primary_key__]
+        return 'SELECT %s FROM `%s`' % (', '.join('`%s`' % f for f in columns), cls.__table__)
+
+    # 为instances一次查询补齐fields中尚未加载的字段，fields未指定时补齐所有延迟加载字段
+    # SELECT `id`, `content` FROM `blogs` WHERE `id` IN (?, ?, ...)
+    @classmethod
+    async def loadDeferred(cls, instances, fields=None):
+        if fields is None:
+            fields = cls.__deferred__
+        pending = {}
+        missing = set()
+        for instance in instances:
+            lacked = [f for f in fields if f not in instance]
+            if lacked:
+                pending[instance[cls.__primary_key__]] = instance
+                missing.update(lacked)
+        if not pending:
+            return
+        missing = tuple(f for f in fields if f in missing)
+        pks = list(pending)
+        sql = '%s WHERE `%s` IN (%s)' % (cls._buildColumns(missing), cls.__primary_key__, ', '.join('?' * len(pks)))
+        for r in await select(sql, pks):
+            instance = pending[r[cls.__primary_key__]]
+            for f in missing:
+                if f not in instance:
+                    # 补齐的是数据库中的值，不算作修改
+                    dict.__setitem__(instance, f, r[f])
+
+    # 加载本实例尚未加载的字段，与本实例由同一次findAll查询得到的实例会一并加载
+    async def load(self, *fields):
+        siblings = getattr(self, '_siblings', None) or [self]
+        await self.loadDeferred(siblings, fields or None)
 
     # 根据列名和条件查看数据库有多少条信息
     # @classmethod
@@ -199,39 +990,142 @@ class Model(dict, metaclass=ModelMetaclass):
     #         return 0
     #     return resultset[0].get('_num_', 0)
 
+    # 结果按(selectField, where, args)缓存，save()、update()、remove()、saveMany()会清空本模型的缓存
+    # approximate=True且没有where条件时，读取information_schema中的表统计信息代替count，适用于大表
     @classmethod
-    async def findNumber(cls, selectField, where=None, args=None):
+    async def findNumber(cls, selectField, where=None, args=None, approximate=False):
         ' find number by select and where. '
-        sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
-        if where:
-            sql.append('where')
-            sql.append(where)
-        rs = await select(' '.join(sql), args, 1)
+        approximate = approximate and not where
+        ckey = (selectField, where, tuple(args) if args else None, approximate)
+        cached = cls.__counts__.get(ckey)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        generation = cls.__count_generation__
+        if approximate:
+            sql = 'select TABLE_ROWS _num_ from information_schema.TABLES where TABLE_SCHEMA = DATABASE() and TABLE_NAME = ?'
+            args = [cls.__table__]
+        else:
+            key = ('_num_', selectField, where)
+            sql = cls.__statements__.get(key)
+            if sql is None:
+                sql = ['select %s _num_ from `%s`' % (selectField, cls.__table__)]
+                if where:
+                    sql.append('where')
+                    sql.append(where)
+                sql = cls.__statements__[key] = ' '.join(sql)
+        rs = await select(sql, args, 1)
         if len(rs) == 0:
             return None
-        return rs[0]['_num_']
+        num = rs[0]['_num_']
+        # 查询开始后本模型有写操作时，结果可能是写之前的，不能缓存
+        if generation == cls.__count_generation__:
+            if len(cls.__counts__) >= _MAX_STATEMENTS:
+                cls.__counts__.clear()
+            cls.__counts__[ckey] = (num, time.time() + COUNT_CACHE_TTL)
+        return num
+
+    # 本模型的表发生写操作后清空findNumber的缓存
+    @classmethod
+    def _invalidateCounts(cls):
+        cls.__count_generation__ += 1
+        cls.__counts__.clear()
+
+    # 注册监听函数: 本模型的实例被update()或remove()后调用fn(instance)，用于使外部缓存失效
+    @classmethod
+    def addListener(cls, fn):
+        cls.__listeners__.append(fn)
+
+    def _notifyListeners(self):
+        for fn in self.__listeners__:
+            fn(self)
 
     # 根据主键查找一个实例的信息
+    # fields指定要选出的字段，未指定时选出所有字段(包括延迟加载字段)
     @classmethod
-    async def find(cls, pk):
+    async def find(cls, pk, fields=None):
         ' find object by primary key. '
-        resultset = await select('%s WHERE `%s`= ?' % (cls.__select__,
-                                                       cls.__primary_key__), [pk], 1)
-        return cls(**resultset[0]) if resultset else None
+        if fields is None:
+            sql = cls.__find__
+        else:
+            fields = tuple(fields)
+            key = ('_find_', fields)
+            sql = cls.__statements__.get(key)
+            if sql is None:
+                sql = cls.__statements__[key] = '%s WHERE `%s`= ?' % (cls._buildColumns(fields), cls.__primary_key__)
+        names, resultset = await select_rows(sql, [pk], 1)
+        if not resultset:
+            return None
+        instance = cls._fromRows(names, resultset)[0]
+        if fields is not None:
+            # 只选出部分字段时与findAll一样记录，之后load()可以补齐其他字段；update()只写入修改过的字段，不会改动没有选出的列
+            _set_siblings(instance, [instance])
+        return instance
+
+    # 根据一组主键批量查找实例，每chunk_size个主键一条WHERE `id` IN (...)查询
+    # 返回的列表与pks一一对应，不存在的主键对应None
+    @classmethod
+    async def findMany(cls, pks, fields=None, chunk_size=500):
+        if fields is not None:
+            fields = tuple(fields)
+        unique = list(dict.fromkeys(pks))
+        found = {}
+        for start in range(0, len(unique), chunk_size):
+            chunk = unique[start:start + chunk_size]
+            key = ('_in_', fields, len(chunk))
+            sql = cls.__statements__.get(key)
+            if sql is None:
+                columns = cls.__select__ if fields is None else cls._buildColumns(fields)
+                sql = cls.__statements__[key] = '%s WHERE `%s` IN (%s)' % (columns, cls.__primary_key__, ', '.join('?' * len(chunk)))
+            names, resultset = await select_rows(sql, chunk)
+            for instance in cls._fromRows(names, resultset):
+                found[instance[cls.__primary_key__]] = instance
+        if fields is not None and found:
+            siblings = list(found.values())
+            for instance in siblings:
+                _set_siblings(instance, siblings)
+        return [found.get(pk) for pk in pks]
 
     # 更改一个实例在数据库的信息
+    # 从数据库加载的实例只更新加载后被修改过的字段，没有修改时不执行任何语句；
+    # 直接构造的实例(未从数据库加载)仍按__update__更新所有字段
     async def update(self):
-        args = list(map(self.get, self.__fields__))
-        # args.append(self.getValue(self.__primary_key__))
-        # 第104行已经将primary_key加入，无需再次加入
-        rows = await execute(self.__update__, args)
+        dirty = getattr(self, '_dirty', None)
+        if dirty is None:
+            args = list(map(self.get, self.__fields__))
+            # args.append(self.getValue(self.__primary_key__))
+            # 第104行已经将primary_key加入，无需再次加入
+            sql = self.__update__
+        else:
+            fields = tuple(f for f in self.__fields__ if f in dirty and f != self.__primary_key__)
+            if not fields:
+                logging.debug('nothing to update: %s' % self.get(self.__primary_key__))
+                return
+            sql = self._buildUpdate(fields)
+            args = list(map(self.get, fields))
+            args.append(self.get(self.__primary_key__))
+        rows = await execute(sql, args)
+        _set_dirty(self, _CLEAN)
+        self._invalidateCounts()
+        self._notifyListeners()
         if rows != 1:
             logging.warning('failed to update record: affected rows: %s' % rows)
 
+    # 生成只更新fields的UPDATE语句，按字段组合缓存在__statements__中
+    @classmethod
+    def _buildUpdate(cls, fields):
+        key = ('_update_', fields)
+        sql = cls.__statements__.get(key)
+        if sql is None:
+            sql = cls.__statements__[key] = 'UPDATE `%s` SET %s WHERE `%s` = ?' % (cls.__table__,
+                                                                                 ', '.join('`%s` = ?' % f for f in fields), cls.__primary_key__)
+        return sql
+
     # 把一个实例从数据库中删除
     async def remove(self):
         args = [self.get(self.__primary_key__)]
         rows = await execute(self.__delete__, args)
+        self._invalidateCounts()
+        self._notifyListeners()
         if rows != 1:
             logging.warning('failed to remove by primary key: affected rows: %s' % rows)
 
@@ -241,17 +1135,117 @@ class Model(dict, metaclass=ModelMetaclass):
         # args.append(self.getValueOrDeflault(self.__primary_key__))
         # 第104行已经将primary_key加入，无需再次加入
         rows = await execute(self.__insert__, args)
+        _set_dirty(self, _CLEAN)
+        self._invalidateCounts()
         if rows != 1:
             logging.warning('failed to insert record: affected rows: %s' % rows)
 
+    # 批量保存实例: 每batch_size个实例拼成一条多行INSERT ... VALUES (...),(...)，所有批次在同一个事务中执行
+    @classmethod
+    async def saveMany(cls, instances, batch_size=500):
+        if batch_size < 1:
+            raise ValueError('Invalid batch_size value: %s' % batch_size)
+        instances = list(instances)
+        # 与getValueOrDefault规则相同，但每个字段的默认值只查找一次
+        defaults = [(key, field.default) for key, field in cls.__mappings__.items()]
+        rows = []
+        for instance in instances:
+            row = []
+            for key, default in defaults:
+                value = instance.get(key)
+                if value is None and default is not None:
+                    value = default() if callable(default) else default
+                    instance[key] = value
+                row.append(value)
+            rows.append(row)
+        if not rows:
+            return 0
+        statements = []
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            args = []
+            for row in batch:
+                args.extend(row)
+            statements.append((cls._buildInsert(len(batch)), args))
+        rows_affected = await execute_batch(statements)
+        for instance in instances:
+            _set_dirty(instance, _CLEAN)
+        cls._invalidateCounts()
+        if rows_affected != len(rows):
+            logging.warning('failed to insert records: affected rows: %s of %s' % (rows_affected, len(rows)))
+        return rows_affected
+
+    # 生成一次插入n行的INSERT语句，按行数缓存在__statements__中
+    @classmethod
+    def _buildInsert(cls, n):
+        key = ('_insert_', n)
+        sql = cls.__statements__.get(key)
+        if sql is None:
+            prefix = cls.__insert__[:cls.__insert__.rindex(' VALUES ')]
+            sql = cls.__statements__[key] = '%s VALUES %s' % (prefix, ', '.join([cls.__insert_row__] * n))
+        return sql
+
+    # --------------------表结构(DDL)------------------------------------
+    # 生成建表语句，包括__indexes__中声明的索引
+    @classmethod
+    def tableDDL(cls):
+        lines = ['    `%s` %s not null' % (f, field.column_type) for f, field in cls.__mappings__.items()]
+        lines.extend('    %s' % index.ddl() for index in cls.__indexes__)
+        lines.append('    primary key (`%s`)' % cls.__primary_key__)
+        return 'create table `%s` (\n%s\n) engine=innodb default charset=utf8' % (cls.__table__, ',\n'.join(lines))
+
+    # 为已存在的表逐个创建__indexes__中声明的索引的语句
+    @classmethod
+    def indexDDL(cls):
+        return [index.createDDL(cls.__table__) for index in cls.__indexes__]
+
+    # 与当前数据库中的表结构比较，返回使表结构与模型一致所需的DDL语句列表，不执行这些语句:
+    # 表不存在时为建表语句；缺少的列为ADD COLUMN；缺少的索引为CREATE INDEX；
+    # 同名但列不同的索引先DROP再CREATE。数据库中多出的列和索引只记录日志，不删除
+    @classmethod
+    async def schemaDiff(cls):
+        columns = await select('SELECT COLUMN_NAME AS name FROM information_schema.COLUMNS '
+                               'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ?', [cls.__table__])
+        if not columns:
+            return [cls.tableDDL()]
+        statements = []
+        live_columns = set(c['name'] for c in columns)
+        for f, field in cls.__mappings__.items():
+            if f not in live_columns:
+                statements.append('alter table `%s` add column `%s` %s not null' % (cls.__table__, f, field.column_type))
+        for f in live_columns - set(cls.__mappings__):
+            logging.warning('column %s.%s is not mapped by %s' % (cls.__table__, f, cls.__name__))
+        rows = await select('SELECT INDEX_NAME AS name, COLUMN_NAME AS field, NON_UNIQUE AS non_unique '
+                            'FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? '
+                            "AND INDEX_NAME <> 'PRIMARY' ORDER BY INDEX_NAME, SEQ_IN_INDEX", [cls.__table__])
+        live = {}
+        for r in rows:
+            fields, unique = live.get(r['name'], ((), not int(r['non_unique'])))
+            live[r['name']] = (fields + (r['field'],), unique)
+        for index in cls.__indexes__:
+            if index.name in live:
+                if live.pop(index.name) == (index.fields, index.unique):
+                    continue
+                statements.append('drop index `%s` on `%s`' % (index.name, cls.__table__))
+            statements.append(index.createDDL(cls.__table__))
+        for name, (fields, unique) in live.items():
+            logging.warning('index %s.%s %s is not declared by %s' % (cls.__table__, name, fields, cls.__name__))
+        return statements
+
+
+# Model.__slots__的赋值函数: Model.__setattr__会把属性写成dict的键，内部状态通过slot描述符直接赋值
+_set_dirty = Model._dirty.__set__
+_set_siblings = Model._siblings.__set__
+
 
 class Field(object):
 
-    def __init__(self, name, column_type, primary_key, default):
+    def __init__(self, name, column_type, primary_key, default, deferred=False):
         self.name = name
         self.column_type = column_type
         self.primary_key = primary_key
         self.default = default
+        self.deferred = deferred    # 延迟加载的字段不会出现在findAll默认选出的列中
 
     def __str__(self):
         return '<%s, %s:%s>' % (self.__class__.__name__, self.column_type, self.name)
@@ -287,5 +1281,73 @@ class FloatField(Field):
 
 class TextField(Field):
 
-    def __init__(self, name=None, default=None):
-        super().__init__(name, 'text', False, default)
+    # 大文本字段可设为deferred=True，列表查询时不选出，需要时通过load()批量加载
+    def __init__(self, name=None, default=None, deferred=False, ddl='text'):
+        super().__init__(name, ddl, False, default, deferred)
+
+
+# 索引定义，用在模型的__indexes__中，如Index('email', unique=True)、Index('blog_id', 'created_at')
+# 索引名默认为idx_加上以下划线连接的字段名
+class Index(object):
+
+    def __init__(self, *fields, unique=False, name=None):
+        if not fields:
+            raise ValueError('Index requires at least one field')
+        self.fields = tuple(fields)
+        self.unique = unique
+        self.name = name or 'idx_%s' % '_'.join(fields)
+
+    # 建表语句中的索引定义
+    def ddl(self):
+        return '%skey `%s` (%s)' % ('unique ' if self.unique else '', self.name, ', '.join('`%s`' % f for f in self.fields))
+
+    def createDDL(self, table):
+        return 'create %sindex `%s` on `%s` (%s)' % ('unique ' if self.unique else '', self.name, table,
+                                                   ', '.join('`%s`' % f for f in self.fields))
+
+    def __str__(self):
+        return '<%s, %s:%s>' % (self.__class__.__name__, self.name, ', '.join(self.fields))
+
+
+# 合并查询: 同一轮事件循环中对同一模型的多次load(pk)合并为一次findMany查询，并缓存已取得的结果
+# 应在每个请求中新建，如loader = DataLoader(Blog); blog = await loader.load(comment.blog_id)
+class DataLoader(object):
+
+    def __init__(self, model):
+        self._model = model
+        self._futures = {}      # 主键 => 结果的Future，同一主键只查询一次
+        self._pending = []      # 等待下一次批量查询的主键
+
+    def load(self, pk):
+        fut = self._futures.get(pk)
+        if fut is None:
+            loop = asyncio.get_event_loop()
+            fut = self._futures[pk] = loop.create_future()
+            if not self._pending:
+                # 本轮事件循环中第一次load，在下一轮统一查询
+                loop.call_soon(self._dispatch)
+            self._pending.append(pk)
+        return fut
+
+    # 返回可等待对象，调用时即登记所有主键，与同一轮的其他load合并查询
+    def loadMany(self, pks):
+        return asyncio.gather(*[self.load(pk) for pk in pks])
+
+    def _dispatch(self):
+        pks, self._pending = self._pending, []
+        asyncio.ensure_future(self._fetch(pks))
+
+    async def _fetch(self, pks):
+        try:
+            results = await self._model.findMany(pks)
+        except BaseException as e:
+            for pk in pks:
+                # 查询失败时不缓存，之后可以重新load
+                fut = self._futures.pop(pk)
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for pk, instance in zip(pks, results):
+            fut = self._futures[pk]
+            if not fut.done():
+                fut.set_result(instance)
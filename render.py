@@ -0,0 +1,121 @@
+import os
+import atexit
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import markdown2
+from cache import LRUCache
+
+# 日志正文渲染结果的缓存，按HTML字符数限制总大小，约16M字符
+RENDER_CACHE_SIZE = 16 * 1024 * 1024
+
+_html_cache = LRUCache(RENDER_CACHE_SIZE, sizeof=len)
+
+# 少于该字符数的文本直接在事件循环中渲染(几毫秒以内)，更长的文本交给渲染进程池，避免阻塞其他请求
+RENDER_INLINE_LIMIT = 4096
+# 渲染进程数
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+# 同时提交给进程池的渲染任务上限，超过时后来的请求在事件循环中等待(背压)，而不是无限排队
+RENDER_MAX_PENDING = 2 * RENDER_WORKERS
+
+_executor = None
+_slots = None
+# 正在渲染的文档: 缓存键 => 渲染任务，同一篇日志并发的多个请求只渲染一次
+_rendering = {}
+
+
+# 以markdown源文本的哈希和渲染选项作为缓存键，内容不变时不会重复渲染
+def _cache_key(text, extras):
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    return digest, tuple(sorted(extras)) if extras else ()
+
+
+# 在渲染进程中执行，返回普通str以减少进程间传递的开销
+# 使用markdown_blocks按段落缓存转换结果，修改日志后重新渲染时只转换改动的段落；段落缓存在各进程内
+def _convert(text, extras):
+    return str(markdown2.markdown_blocks(text, extras=extras))
+
+
+# 渲染进程启动时先转换一段示例文本，使模块导入和正则编译在处理第一个请求之前完成
+def _warm_up():
+    markdown2.markdown('# warm up\n\n*text* with [link](http://example.com)\n\n    code\n\n- item\n')
+
+
+# 启动渲染进程池，应在服务启动时调用，使工作进程在处理请求前就绪；
+# 未调用时第一次渲染长文本时再启动
+def start_render_pool(workers=None):
+    global _executor
+    if _executor is not None:
+        return _executor
+    workers = workers or RENDER_WORKERS
+    logging.info('start markdown render pool with %s workers...' % workers)
+    _executor = ProcessPoolExecutor(max_workers=workers, initializer=_warm_up)
+    # 进程池按需创建工作进程，同时提交workers个任务使所有进程立即启动
+    for _ in range(workers):
+        _executor.submit(len, '')
+    return _executor
+
+
+def close_render_pool():
+    global _executor, _slots
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+        _slots = None
+
+
+# 进程退出时关闭渲染进程池；进程池重建后仍只注册一次
+atexit.register(close_render_pool)
+
+
+# 异步渲染markdown: 命中缓存直接返回；短文本在当前线程渲染；长文本在渲染进程池中渲染，
+# 进程池繁忙时等待空位，不阻塞事件循环
+async def render_markdown(text, extras=None):
+    key = _cache_key(text, extras)
+    html = _html_cache.get(key)
+    if html is not None:
+        return html
+    if len(text) < RENDER_INLINE_LIMIT:
+        html = markdown2.markdown_blocks(text, extras=extras)
+        _html_cache.set(key, html)
+        return html
+    # 渲染任务不属于任何一个请求: 某个请求被取消时只停止等待，其他等待同一篇日志的请求不受影响
+    task = _rendering.get(key)
+    if task is None:
+        task = _rendering[key] = asyncio.ensure_future(_render_in_pool(key, text, extras))
+        task.add_done_callback(lambda t: _render_done(key, t))
+    return await asyncio.shield(task)
+
+
+async def _render_in_pool(key, text, extras):
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(RENDER_MAX_PENDING)
+    async with _slots:
+        executor = start_render_pool()
+        try:
+            html = await asyncio.get_event_loop().run_in_executor(executor, _convert, text, extras)
+        except BrokenProcessPool:
+            # 渲染进程异常退出后进程池不能再使用: 丢弃它，下次渲染时重新创建，这次在当前线程渲染
+            logging.warning('markdown render pool is broken, restarting...')
+            _discard_render_pool(executor)
+            html = markdown2.markdown_blocks(text, extras=extras)
+    _html_cache.set(key, html)
+    return html
+
+
+def _discard_render_pool(executor):
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False)
+
+
+def _render_done(key, task):
+    _rendering.pop(key, None)
+    # 所有请求都已取消时没有人读取结果，避免"Task exception was never retrieved"警告
+    if not task.cancelled():
+        task.exception()
@@ -0,0 +1,43 @@
+import sys
+import asyncio
+import logging
+
+from orm import create_pool, destroy_pool
+from model import User, Blog, Comment
+from config.config import configs
+
+MODELS = [User, Blog, Comment]
+
+
+# 根据model.py中的模型定义生成表结构:
+# python3 schema.py          输出所有表的建表语句(包括索引)
+# python3 schema.py --diff   与config中数据库的表结构比较，输出使其与模型一致所需的DDL语句，不会执行
+def create_statements():
+    return [model.tableDDL() for model in MODELS]
+
+
+async def diff_statements(loop):
+    await create_pool(loop=loop, **configs.db)
+    try:
+        statements = []
+        for model in MODELS:
+            statements.extend(await model.schemaDiff())
+        return statements
+    finally:
+        await destroy_pool()
+
+
+def main(argv):
+    if '--diff' in argv:
+        loop = asyncio.get_event_loop()
+        statements = loop.run_until_complete(diff_statements(loop))
+        if not statements:
+            logging.info('schema is up to date')
+    else:
+        statements = create_statements()
+    for sql in statements:
+        print('%s;\n' % sql)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,57 @@
+import json
+
+from errors import Page, CursorPage
+from orm import Record
+
+# 有C实现的orjson时使用它，直接输出UTF-8字节；否则使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 已注册的类型编码函数: [(类型, 将对象转换为可序列化对象的函数)]
+_encoders = []
+
+
+# 按对象的具体类型缓存查找到的编码函数，大量同类对象(如Record)只需查找一次
+_dispatch = {}
+
+
+# 注册某个类型的编码函数，fn(obj)返回dict、list等可直接序列化的对象
+def register(cls, fn):
+    _encoders.append((cls, fn))
+    _dispatch.clear()
+
+
+def _resolve(t):
+    for cls, fn in _encoders:
+        if issubclass(t, cls):
+            return fn
+    # 未注册的对象按其属性序列化
+    return _attributes
+
+
+def _attributes(o):
+    return o.__dict__
+
+
+def _default(o):
+    fn = _dispatch.get(type(o))
+    if fn is None:
+        fn = _dispatch[type(o)] = _resolve(type(o))
+    return fn(o)
+
+
+register(Page, lambda p: p.__dict__)
+register(CursorPage, lambda p: p.__dict__)
+register(Record, Record._asdict)
+
+# Model继承自dict，两种编码器都能直接序列化，不需要注册
+_encoder = json.JSONEncoder(ensure_ascii=False, default=_default)
+
+
+# 将对象序列化为UTF-8编码的JSON字节串
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return _encoder.encode(obj).encode('utf-8')
@@ -0,0 +1,132 @@
+import os
+import sys
+import timeit
+import asyncio
+import logging
+from urllib import parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import errors
+from coroweb import RequestHandler
+from aiohttp import web
+
+# 与线上相同，INFO日志不输出，只测参数绑定本身的开销
+logging.disable(logging.INFO)
+
+
+# 模拟aiohttp的request，只提供RequestHandler用到的属性
+class FakeRequest(object):
+    def __init__(self, method='GET', query_string='', match_info=None, json=None):
+        self.method = method
+        self.query_string = query_string
+        self.match_info = match_info or {}
+        self.content_type = 'application/json' if json is not None else ''
+        self._json = json
+
+    async def json(self):
+        return dict(self._json)
+
+
+# 改造前的RequestHandler.__call__: 每个请求都走完整的判断流程
+class LegacyRequestHandler(RequestHandler):
+    async def __call__(self, request):
+        kw = None
+        if self._has_var_kw_arg or self._has_named_kw_args or self._required_kw_args:
+            if request.method == 'POST':
+                if not request.content_type:
+                    return web.HTTPBadRequest('Missing Content-Type.')
+                ct = request.content_type.lower()
+                if ct.startswith('application/json'):
+                    params = await request.json()
+                    if not isinstance(params, dict):
+                        return web.HTTPBadRequest('JSON body must be object.')
+                    kw = params
+                else:
+                    return web.HTTPBadRequest(
+                        'Unsupported Content-Type: %s' % request.content_type)
+            if request.method == 'GET':
+                qs = request.query_string
+                if qs:
+                    kw = dict()
+                    for k, v in parse.parse_qs(qs, True).items():
+                        kw[k] = v[0]
+        if kw is None:
+            kw = dict(**request.match_info)
+        else:
+            if not self._has_var_kw_arg and self._named_kw_args:
+                copy = dict()
+                for name in self._named_kw_args:
+                    if name in kw:
+                        copy[name] = kw[name]
+                kw = copy
+            for k, v in request.match_info.items():
+                if k in kw:
+                    logging.warning(
+                        'Duplicate arg name in named arg and kw args: %s' % k)
+                kw[k] = v
+        if self._has_request_arg:
+            kw['request'] = request
+        if self._required_kw_args:
+            for name in self._required_kw_args:
+                if not name in kw:
+                    return web.HTTPBadRequest('Missing argument: %s' % name)
+        logging.info('call with args: %s' % str(kw))
+        try:
+            r = await self._func(**kw)
+            return r
+        except errors.APIError as e:
+            return dict(error=e.error, data=e.data, message=e.message)
+
+
+# 各种签名的空URL函数
+async def noop_plain():
+    return None
+
+
+async def noop_path(id):
+    return None
+
+
+async def noop_page(*, page='1'):
+    return None
+
+
+async def noop_post(id, request, *, name, summary, content):
+    return None
+
+
+CASES = [
+    ('GET  fn()', noop_plain, FakeRequest()),
+    ('GET  fn(id)', noop_path, FakeRequest(match_info={'id': '001'})),
+    ('GET  fn(*, page) ?page=3&x=1', noop_page, FakeRequest(query_string='page=3&x=1')),
+    ('POST fn(id, request, *, name, summary, content)', noop_post,
+     FakeRequest('POST', match_info={'id': '001'}, json=dict(name='n', summary='s', content='c', extra='e'))),
+]
+
+# 每次run在同一个协程里连续处理BATCH个请求，以摊薄事件循环调度本身的开销
+BATCH = 100
+
+
+def bench(name, loop, handler, request, number=200):
+    async def many():
+        for i in range(BATCH):
+            await handler(request)
+
+    def run():
+        loop.run_until_complete(many())
+    run()
+    cost = min(timeit.repeat(run, number=number, repeat=3))
+    print('%-55s %8.3f us/request' % (name, cost / (number * BATCH) * 1e6))
+
+
+def main():
+    loop = asyncio.new_event_loop()
+    for name, fn, request in CASES:
+        bench('%s [old]' % name, loop, LegacyRequestHandler(None, fn), request)
+        bench('%s [new]' % name, loop, RequestHandler(None, fn), request)
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown2
+
+# 博客中常见的日志: 标题、带链接和强调的段落、列表、引用、缩进代码块和fenced代码块、表格
+PARAGRAPH = ('Python的*asyncio*提供了**事件循环**，详见[官方文档](https://docs.python.org/3/library/asyncio.html)'
+             '和[aiohttp][1]。在协程中使用`await`等待IO，不要执行耗时的CPU计算。\n')
+
+SECTION = '''## 第%(n)d节 示例
+
+%(paragraph)s
+%(paragraph)s
+- 第一项，包含`code`
+- 第二项，包含[链接](http://example.com/%(n)d)
+    - 嵌套项
+- 第三项
+
+1. 有序列表
+2. 第二项
+
+> 引用的内容，
+> 可以跨多行。
+
+    def handler(request):
+        return web.Response(body=b'%(n)d')
+
+```python
+async def main():
+    await asyncio.sleep(%(n)d)
+```
+
+| 列 | 说明 |
+|----|------|
+| a | %(n)d |
+| b | 描述 |
+
+'''
+
+LINKS = '\n[1]: https://aiohttp.readthedocs.io/ "aiohttp"\n'
+
+
+# 生成由sections节组成的日志
+def make_post(sections):
+    body = ''.join(SECTION % dict(n=n, paragraph=PARAGRAPH) for n in range(sections))
+    return '# 标题\n\n' + body + LINKS
+
+
+SNIPPET = '''说明第%(n)d段代码:
+
+```python
+class Handler%(n)d(object):
+    def __init__(self, name='handler%(n)d'):
+        self.name = name
+
+    async def __call__(self, request):
+        data = await request.json()
+        return {'name': self.name, 'items': [x * %(n)d for x in data]}
+```
+
+'''
+
+
+# 包含n段代码的技术日志
+def make_code_post(n):
+    return '# 代码示例\n\n' + ''.join(SNIPPET % dict(n=i) for i in range(n))
+
+
+# 短评论、普通日志、长技术日志
+CORPUS = [
+    ('comment', '简短的评论，带*强调*和[链接](http://example.com)。'),
+    ('post', make_post(3)),
+    ('long post', make_post(30)),
+]
+
+EXTRAS = ['fenced-code-blocks', 'tables']
+
+# 按段落转换容易出错的结构，markdown_blocks()的结果必须与markdown()完全相同
+EDGE_CASES = [
+    '## Install\n- step one\n\n- step two\n',
+    '## Quote\n> first\n\n> second\n',
+    '* item\n\n[a]: http://a.com\n* item',
+    '* item\n> quoted\n\n* item\n',
+    'para\n\n    code\n\n    more code\n\npara\n',
+    '- a\n\n- b\n\n    cont\n\n1. x\n2. y\n\nafter\n',
+    '  - nested\n- step\n\n    code\n2. second\n\nlazy\n\n2. second',
+    '```\n[a]: http://a.com\n\ncode\n```\n\ntext [a]\n\n[a]: http://b.com\n',
+    '```\n```\n```\n\n```',
+    'a\n\n\n\nb\n\n```\nx\n\n\ny\n```\n',
+    '',
+    'para one\n[b]: http://b.com\n    \npara two\n',
+    'para one\r\n\t\r\npara two\n\n\tcode\n',
+]
+
+
+def bench(name, fn, number):
+    cost = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print('%-45s %10.1f us' % (name, cost * 1e6))
+
+
+# 检查markdown_blocks()与markdown()的结果一致
+def check():
+    docs = [text for _, text in CORPUS] + [make_code_post(3)] + EDGE_CASES
+    for extras in (None, EXTRAS):
+        for text in docs:
+            expected = markdown2.markdown(text, extras=extras)
+            # 第二次转换使用缓存的段落
+            for i in range(2):
+                assert markdown2.markdown_blocks(text, extras=extras) == expected, (extras, text[:60])
+    print('markdown_blocks() matches markdown() on %d documents' % (2 * len(docs)))
+
+
+def main():
+    check()
+    # 每次转换的固定开销: 新建Markdown对象(旧的markdown()每次都会新建)与从转换器池中取出
+    bench('Markdown() construction', lambda: markdown2.Markdown(extras=EXTRAS), 20000)
+    bench('convert empty text [fresh Markdown]', lambda: markdown2.Markdown(extras=EXTRAS).convert(''), 5000)
+    bench('convert empty text [pooled markdown()]', lambda: markdown2.markdown('', extras=EXTRAS), 5000)
+    # 解析本身的耗时
+    for name, text in CORPUS:
+        number = max(10, 20000 // len(text))
+        bench('%s (%d chars) [fresh Markdown]' % (name, len(text)),
+              lambda: markdown2.Markdown(extras=EXTRAS).convert(text), number)
+        bench('%s (%d chars) [pooled markdown()]' % (name, len(text)),
+              lambda: markdown2.markdown(text, extras=EXTRAS), number)
+    # 包含40段代码的日志: 每次都清空高亮缓存(每段代码都调用Pygments)与使用共享的高亮缓存
+    code_post = make_code_post(40)
+
+    def uncached():
+        markdown2._highlight_cache.clear()
+        return markdown2.markdown(code_post, extras=EXTRAS)
+    bench('code post (40 snippets) [highlight uncached]', uncached, 10)
+    bench('code post (40 snippets) [highlight cached]', lambda: markdown2.markdown(code_post, extras=EXTRAS), 10)
+    # 编辑长日志中的一段后重新转换: 整篇转换与按段落缓存(只转换改动的段落)
+    text = CORPUS[-1][1]
+    edits = iter(range(10 ** 9))
+
+    def edited():
+        return text.replace('第15节 示例', '第15节 示例 %d' % next(edits))
+    markdown2.markdown_blocks(text, extras=EXTRAS)
+    bench('long post, one block edited [markdown()]', lambda: markdown2.markdown(edited(), extras=EXTRAS), 10)
+    bench('long post, one block edited [markdown_blocks()]',
+          lambda: markdown2.markdown_blocks(edited(), extras=EXTRAS), 10)
+
+
+if __name__ == '__main__':
+    main()
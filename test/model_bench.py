@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import timeit
+import logging
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 关闭导入model时的映射日志
+logging.disable(logging.INFO)
+
+import serializer
+from model import Comment, next_id
+
+N = 10000
+
+
+# 模拟数据库返回的10k条评论
+def make_rows():
+    return [dict(id=next_id(), blog_id=next_id(), user_id=next_id(), user_name='user%s' % i,
+                 user_image='about:blank', content='comment %s' % i, created_at=time.time())
+            for i in range(N)]
+
+
+# 构造N个对象，返回(对象列表, 耗时, 结果占用的内存)，耗时在关闭tracemalloc时测量
+def build(rows, factory):
+    cost = min(timeit.repeat(lambda: factory(rows), number=5, repeat=3)) / 5
+    tracemalloc.start()
+    objs = factory(rows)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return objs, cost, size
+
+
+def access(objs):
+    for o in objs:
+        o.user_name, o.content, o.created_at
+
+
+def main():
+    rows = make_rows()
+    # 普通游标返回的tuple结果集
+    names = tuple(rows[0])
+    tuples = [tuple(r.values()) for r in rows]
+    # dict路径包含DictCursor为每行构造dict的开销
+    cases = (
+        ('Model(**dict)', lambda rs: [Comment(**dict(zip(names, r))) for r in rs]),
+        ('Record(**dict)', lambda rs: [Comment.__record__(**dict(zip(names, r))) for r in rs]),
+        ('Model tuples', lambda rs: Comment._fromRows(names, rs)),
+        ('Record tuples', lambda rs: Comment._fromRows(names, rs, compact=True)),
+    )
+    for name, factory in cases:
+        objs, cost, size = build(tuples, factory)
+        attr = min(timeit.repeat(lambda: access(objs), number=10, repeat=3)) / 10
+        dump = min(timeit.repeat(lambda: serializer.dumps(objs), number=5, repeat=3)) / 5
+        print('%-14s build %7.2f ms   memory %8.1f KB   attribute access %6.2f ms   json %6.2f ms' % (
+            name, cost * 1e3, size / 1024, attr * 1e3, dump * 1e3))
+
+
+if __name__ == '__main__':
+    main()
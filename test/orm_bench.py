@@ -0,0 +1,132 @@
+import os
+import sys
+import timeit
+import asyncio
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 基准测试只关心ORM本身的CPU开销，关闭INFO日志(包括导入model时的映射日志)
+logging.disable(logging.INFO)
+
+import orm
+from model import Blog, Comment
+
+
+# 模拟连接池: 游标只记录语句，不访问数据库，测出的时间即为ORM层拼接/转换SQL的开销
+class FakeCursor(object):
+    rowcount = 1
+    description = ()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def execute(self, sql, args):
+        self.sql = sql
+
+    async def fetchall(self):
+        return []
+
+    async def fetchmany(self, size):
+        return []
+
+
+class FakeConnection(object):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def cursor(self, *args):
+        return FakeCursor()
+
+
+class FakePool(object):
+    def get(self):
+        return FakeConnection()
+
+
+# 改造前的实现: 每次调用都重新拼接SQL并执行sql.replace('?', '%s')，并且总是格式化SQL日志
+# 与新实现一样从(模拟的)连接池取连接，两者只差ORM层本身的开销
+async def legacy_select(sql, args, size=None):
+    logging.info('SQl: [%s] args: %s' % (sql, args or []))
+    async with getattr(orm, '__pool').get() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql.replace('?', '%s'), args)
+            if size:
+                resultset = await cur.fetchmany(size)
+            else:
+                resultset = await cur.fetchall()
+        logging.info('row returned: %s' % len(resultset))
+        return resultset
+
+
+async def legacy_findAll(cls, where=None, args=None, **kw):
+    sql = [cls.__select__]
+    if args is None:
+        args = []
+    if where:
+        sql.append('WHERE ')
+        sql.append(where)
+    if kw.get('orderBy') is not None:
+        sql.append('ORDER BY %s' % (kw['orderBy']))
+    limit = kw.get('limit')
+    if limit is not None:
+        if isinstance(limit, int):
+            sql.append('LIMIT ?')
+            args.append(limit)
+        elif isinstance(limit, tuple) and len(limit) == 2:
+            sql.append('LIMIT ?, ?')
+            args.extend(limit)
+    resultset = await legacy_select(' '.join(sql), args)
+    return [cls(**r) for r in resultset]
+
+
+async def legacy_find(cls, pk):
+    resultset = await legacy_select('%s WHERE `%s`= ?' % (cls.__select__,
+                                                          cls.__primary_key__), [pk], 1)
+    return cls(**resultset[0]) if resultset else None
+
+
+# 每次run在同一个协程里连续执行BATCH次查询，以摊薄事件循环调度本身的开销
+BATCH = 100
+
+
+async def many(coro_fn):
+    for i in range(BATCH):
+        await coro_fn()
+
+
+def bench(name, loop, coro_fn, number=200):
+    def run():
+        loop.run_until_complete(many(coro_fn))
+    # 先执行一次，使缓存就绪
+    run()
+    cost = min(timeit.repeat(run, number=number, repeat=3))
+    print('%-45s %8.3f us/op' % (name, cost / (number * BATCH) * 1e6))
+
+
+def main():
+    setattr(orm, '__pool', FakePool())
+    loop = asyncio.new_event_loop()
+    cases = [
+        ('Blog.find', lambda: legacy_find(Blog, '001'), lambda: Blog.find('001')),
+        ("Comment.findAll('blog_id=?')",
+         lambda: legacy_findAll(Comment, 'blog_id=?', ['001'], orderBy='created_at'),
+         lambda: Comment.findAll('blog_id=?', ['001'], orderBy='created_at')),
+        ('Blog.findAll(limit=(offset, limit))',
+         lambda: legacy_findAll(Blog, orderBy='created_at desc', limit=(10, 10)),
+         lambda: Blog.findAll(orderBy='created_at desc', limit=(10, 10))),
+    ]
+    for name, old, new in cases:
+        bench('%s [old]' % name, loop, old)
+        bench('%s [new]' % name, loop, new)
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
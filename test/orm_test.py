@@ -52,7 +52,33 @@ async def test1(loop):
     await destroy_pool()  # 这里先销毁连接池
     print('test ok')
 
+# 测试saveMany批量insert语句，batch_size=2时5个用户分3条语句写入
+async def test_save_many(loop):
+    await create_pool(loop=loop, host='localhost', port=3306, user='www-data', password='www-data', db='awesome')
+    new_users = []
+    for idx in range(5):
+        u = User(
+            name='batch%s' % idx,
+            email='mybatch%s@org.com' % idx,
+            passwd='orm456%s' % idx,
+            image='about:blank'
+        )
+        row = await User.findNumber('count(id)', 'email=?', [u.email])
+        if row == 0:
+            new_users.append(u)
+        else:
+            print('the email is already registered...')
+    saved = await User.saveMany(new_users, batch_size=2)
+    logging.info('saveMany saved %s of %s users' % (saved, len(new_users)))
+    assert saved == len(new_users)
+    for u in new_users:
+        assert await User.findNumber('count(id)', 'email=?', [u.email]) == 1
+
+    await destroy_pool()
+    print('test saveMany ok')
+
 if __name__ == '__main__':
     loop = asyncio.get_event_loop()
+    loop.run_until_complete(test_save_many(loop))
     loop.run_until_complete(test1(loop))
     loop.close()